@@ -0,0 +1,82 @@
+# archiver/assets.py
+import hashlib
+import mimetypes
+import os
+import posixpath
+import threading
+from urllib.parse import urlparse
+
+# Directory under the archive root holding every external asset
+ASSET_DIR = 'assets'
+
+# Extensions for the types the archiver produces; mimetypes is consulted
+# for anything else, then the URL's own extension
+ASSET_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/avif': '.avif',
+    'image/svg+xml': '.svg',
+    'image/x-icon': '.ico',
+    'image/vnd.microsoft.icon': '.ico',
+    'text/css': '.css',
+    'text/javascript': '.js',
+    'application/javascript': '.js',
+    'font/woff': '.woff',
+    'font/woff2': '.woff2',
+}
+
+
+def asset_extension(content_type, url=None):
+    """Pick a file extension for an asset so a web server sends the right type"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    extension = ASSET_EXTENSIONS.get(content_type) or mimetypes.guess_extension(content_type or '')
+    if not extension and url:
+        extension = posixpath.splitext(urlparse(url).path)[1].lower()
+    return extension or '.bin'
+
+
+def relative_reference(stored, document_dir):
+    """Reference a stored asset from a document in document_dir; data URLs pass through"""
+    if stored.startswith('data:'):
+        return stored
+    return posixpath.relpath(stored, document_dir or '.')
+
+
+class AssetStore:
+    """Content-addressed asset files under ``<output_dir>/assets``
+
+    Each distinct body is written once as ``assets/<sha256>.<ext>``, however
+    many pages or URLs reference it, and pages link to it by relative path.
+    Names never change for the same content, so the files can be served
+    with far-future cache headers.
+    """
+
+    def __init__(self, output_dir):
+        self.directory = os.path.join(output_dir, ASSET_DIR)
+        self.written = 0
+        self.reused = 0
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def store(self, data, content_type=None, url=None):
+        """Write data unless already present, returning its path relative to the archive root"""
+        name = hashlib.sha256(data).hexdigest() + asset_extension(content_type, url)
+        with self._lock:
+            known = name in self._known
+            self._known.add(name)
+
+        path = os.path.join(self.directory, name)
+        if known or os.path.exists(path):
+            with self._lock:
+                self.reused += 1
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            with self._lock:
+                self.written += 1
+        return f"{ASSET_DIR}/{name}"
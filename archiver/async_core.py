@@ -0,0 +1,230 @@
+# archiver/async_core.py
+import asyncio
+import time
+from urllib.parse import urlparse
+import aiohttp
+from archiver.core import WebsiteArchiver
+from archiver.fetch import HostScheduler, build_response, parse_retry_after
+from archiver.streaming import iter_chunks
+
+
+class AsyncWebsiteArchiver(WebsiteArchiver):
+    """Website archiver that runs the whole crawl on a single event loop
+
+    Pages and their assets are downloaded with aiohttp, bounded by a global
+    and a per-host limit on in-flight requests. HTML and CSS rewriting reuse
+    WebsiteArchiver._process_html, fed with the responses fetched ahead of
+    time, and run in a worker thread so parsing never blocks the loop.
+    """
+
+    def __init__(self, base_url, output_dir=None, max_concurrency=100, max_per_host=None,
+                 max_pages_in_flight=20, **kwargs):
+        super().__init__(base_url, output_dir, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host or max_concurrency
+        self.max_pages_in_flight = max_pages_in_flight
+        if 'max_host_concurrency' not in kwargs:
+            self.scheduler.max_concurrency = self.max_per_host
+            self.scheduler.initial_concurrency = self.max_per_host
+        self._session = None
+        self._request_semaphore = None
+        self._browser_semaphore = None
+        self._async_queue = None
+        self._loop = None
+        self._inflight = {}
+
+    def start_archive(self, progress_callback=None):
+        """Start the archiving process on a new event loop"""
+        try:
+            asyncio.run(self._crawl(progress_callback))
+            self.logger.info(f"Archive complete. Total pages: {len(self.visited_urls)}")
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Archive failed: {str(e)}")
+            return False
+
+        finally:
+            if self.driver_pool:
+                self.driver_pool.close()
+            self._shutdown_asset_pool()
+            self._shutdown_cpu_pool()
+            self._close_image_cache()
+            self._close_warc()
+            self._close_journal()
+            self.fetcher.close()
+
+    async def _crawl(self, progress_callback=None):
+        """Run page workers until the queue is drained"""
+        self._request_semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Keep rendering threads to the number of pooled browsers
+        self._browser_semaphore = asyncio.Semaphore(self.browser_pool_size)
+        self._async_queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._seed_frontier()
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency,
+            limit_per_host=self.max_per_host,
+            ssl=None if self.fetcher.verify else False
+        )
+        timeout = aiohttp.ClientTimeout(total=self.fetcher.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers=self.fetcher.headers) as session:
+            self._session = session
+            workers = [
+                asyncio.create_task(self._async_worker(progress_callback))
+                for _ in range(self.max_pages_in_flight)
+            ]
+            try:
+                await self._async_queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                self._session = None
+
+    def _put_frontier(self, url, depth):
+        """Hand a discovered URL to the loop; rewrites call this from worker threads"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._async_queue.put_nowait((url, depth))
+        else:
+            self._loop.call_soon_threadsafe(self._async_queue.put_nowait, (url, depth))
+
+    async def _async_worker(self, progress_callback=None):
+        """Coroutine counterpart of WebsiteArchiver._worker"""
+        while True:
+            url, depth = await self._async_queue.get()
+            try:
+                if self.active and url not in self.visited_urls:
+                    await self._async_process_url(url, progress_callback, depth)
+            except Exception as e:
+                self.logger.error(f"Worker error: {str(e)}")
+            finally:
+                self._async_queue.task_done()
+
+    async def fetch_async(self, url):
+        """Download a URL on the event loop, sharing downloads already in flight"""
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._download(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        else:
+            self._single_flight.shared += 1
+        return await asyncio.shield(task)
+
+    async def _download(self, url):
+        """Download a URL with aiohttp once the host scheduler allows it"""
+        host = urlparse(url).netloc
+        for attempt in range(self.throttle_retries + 1):
+            await self.scheduler.acquire_async(host)
+            start = time.monotonic()
+            try:
+                async with self._request_semaphore:
+                    async with self._session.get(url) as response:
+                        content = await response.read()
+                        result = build_response(
+                            str(response.url), response.status, response.headers,
+                            content, encoding=response.charset
+                        )
+            except Exception:
+                self.scheduler.release(host, error=True)
+                raise
+
+            retry_after = parse_retry_after(result.headers.get('retry-after'))
+            self.scheduler.release(host, result.status_code, time.monotonic() - start, retry_after,
+                                   attempt=attempt)
+
+            if (result.status_code not in HostScheduler.THROTTLE_STATUSES
+                    or self._retry_after_exceeds_cap(url, retry_after)
+                    or attempt == self.throttle_retries):
+                await asyncio.to_thread(self._record_exchange, result, self.fetcher.headers)
+                return result
+            self.logger.warning(f"Throttled by {host} ({result.status_code}), retrying {url}")
+
+    async def _async_process_url(self, url, progress_callback=None, depth=0):
+        """Process a single URL without blocking the event loop"""
+        url = self.canonicalize(url)
+        if not url.startswith(self.base_url) or not self.visited_urls.add(url):
+            return
+
+        try:
+
+            response = None
+            text = None
+            render = self.wait_for_ajax
+            if render and self.classifier and not self.classifier.remembered(url):
+                # Plain HTTP first; only pages that need JavaScript are rendered
+                response = await self.fetch_async(url)
+                response.raise_for_status()
+                text = response.text if self._is_html(response) else None
+                render = self._needs_browser(url, text)
+
+            html_content = None
+            browser_responses = {}
+            ajax_data = {}
+            if render:
+                async with self._browser_semaphore:
+                    html_content = await asyncio.to_thread(
+                        self.capture_ajax_content, url, browser_responses, ajax_data
+                    )
+
+            if html_content is None:
+                if response is None:
+                    response = await self.fetch_async(url)
+                    response.raise_for_status()
+                if not self._is_html(response):
+                    await asyncio.to_thread(self._save_asset, url, response.content)
+                    html_content = False
+                else:
+                    # Decoded once, whether or not the page was classified
+                    html_content = response.text if text is None else text
+
+            if html_content and self._exceeds_stream_threshold(html_content):
+                await asyncio.to_thread(
+                    self._stream_html_page, url, iter_chunks(html_content), depth, ajax_data
+                )
+            elif html_content:
+                modified_html = await self._async_process_html(url, html_content, depth, browser_responses)
+                await asyncio.to_thread(self._save_html_page, url, modified_html, ajax_data)
+
+            if self.journal:
+                self.journal.record_done(url)
+
+            if progress_callback:
+                progress_callback(len(self.visited_urls), url)
+
+        except Exception as e:
+            self.logger.error(f"Error processing {url}: {str(e)}")
+            if self.journal:
+                self.journal.record_failed(url, e)
+
+    async def _async_process_html(self, base_url, html_content, depth=0, known=None):
+        """Fetch every page resource not in ``known`` concurrently, then rewrite the page"""
+        page = await asyncio.to_thread(self._parse_page, html_content)
+        responses = dict(known or {})
+        urls = [u for u in self._collect_resource_urls(base_url, page) if u not in responses]
+        responses.update(await self._prefetch(urls))
+
+        # Stylesheets reference further assets through url()
+        css_urls = self._collect_stylesheet_urls(responses)
+        responses.update(await self._prefetch(css_urls))
+
+        return await asyncio.to_thread(self._process_html, base_url, page, responses, depth)
+
+    def _prefetch_resources(self, base_url, page, known=None):
+        """Resources were already downloaded on the event loop; no thread pool is needed"""
+        return dict(known or {})
+
+    async def _prefetch(self, urls):
+        """Download a batch of URLs concurrently, keeping failures as exceptions"""
+        results = await asyncio.gather(
+            *(self.fetch_async(url) for url in urls),
+            return_exceptions=True
+        )
+        return dict(zip(urls, results))
@@ -0,0 +1,322 @@
+# archiver/browser.py
+import posixpath
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Counts in-flight XHR/fetch requests and records the last network or DOM
+# activity. Installed before navigation so the initial load is measured.
+NETWORK_TRACKER_JS = """
+(function() {
+    if (window.__archiverTracker) {
+        return;
+    }
+    var tracker = window.__archiverTracker = {inflight: 0, last: performance.now()};
+    function started() {
+        tracker.inflight++;
+        tracker.last = performance.now();
+    }
+    function finished() {
+        tracker.inflight = Math.max(0, tracker.inflight - 1);
+        tracker.last = performance.now();
+    }
+
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function() {
+        started();
+        this.addEventListener('loadend', finished);
+        return send.apply(this, arguments);
+    };
+
+    if (window.fetch) {
+        var fetch = window.fetch;
+        window.fetch = function() {
+            started();
+            try {
+                return fetch.apply(this, arguments).finally(finished);
+            } catch (e) {
+                finished();
+                throw e;
+            }
+        };
+    }
+
+    new MutationObserver(function() {
+        tracker.last = performance.now();
+    }).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+})();
+"""
+
+# True once the document is loaded and network and DOM have been quiet for
+# arguments[0] milliseconds
+PAGE_READY_JS = """
+var tracker = window.__archiverTracker;
+if (document.readyState !== 'complete') {
+    return false;
+}
+if (typeof jQuery !== 'undefined' && jQuery.active > 0) {
+    return false;
+}
+if (!tracker) {
+    return true;
+}
+return tracker.inflight === 0 && performance.now() - tracker.last >= arguments[0];
+"""
+
+# File extensions of the resource types a render can do without; the DOM is
+# built the same, and same-origin assets are downloaded by the rewrite anyway
+RESOURCE_TYPE_EXTENSIONS = {
+    'image': ('png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'bmp', 'ico', 'svg'),
+    'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+    'media': ('mp4', 'webm', 'ogg', 'ogv', 'mp3', 'wav', 'm4a', 'mov', 'm3u8'),
+    'stylesheet': ('css',),
+}
+# Chrome content settings that block a resource type by what it is rather
+# than by its URL (2 = block)
+RESOURCE_TYPE_CONTENT_SETTINGS = {
+    'image': {'profile.managed_default_content_settings.images': 2},
+}
+DEFAULT_BLOCKED_TYPES = ('image', 'font', 'media')
+# Analytics and advertising hosts that never contribute to the archived DOM
+DEFAULT_BLOCKED_HOSTS = (
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net',
+    'googlesyndication.com', 'connect.facebook.net', 'hotjar.com',
+    'segment.io', 'cdn.segment.com', 'mixpanel.com', 'scorecardresearch.com',
+)
+
+
+def blocked_url_patterns(resource_types=(), hosts=()):
+    """Build Network.setBlockedURLs patterns for resource types and hosts
+
+    Extensions are anchored to the end of the path, with or without a query,
+    so a host or directory that merely contains one (gifts.com, /movies/)
+    is not blocked.
+    """
+    patterns = []
+    for resource_type in resource_types:
+        if resource_type not in RESOURCE_TYPE_EXTENSIONS:
+            raise ValueError(f"Unknown resource type to block: {resource_type}")
+        for extension in RESOURCE_TYPE_EXTENSIONS[resource_type]:
+            patterns.extend((f"*.{extension}", f"*.{extension}?*"))
+    for host in hosts:
+        patterns.extend((f"*://{host}/*", f"*://*.{host}/*"))
+    return patterns
+
+
+def blocked_content_settings(resource_types=()):
+    """Chrome preferences blocking the resource types that have a content setting"""
+    prefs = {}
+    for resource_type in resource_types:
+        prefs.update(RESOURCE_TYPE_CONTENT_SETTINGS.get(resource_type, {}))
+    return prefs
+
+
+def block_resources(driver, patterns):
+    """Stop the browser requesting matching URLs; False if CDP is unavailable"""
+    if not patterns:
+        return True
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(patterns)})
+        return True
+    except Exception:
+        return False
+
+
+def install_network_tracker(driver):
+    """Run the tracker on every new document; False if CDP is unavailable"""
+    try:
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': NETWORK_TRACKER_JS})
+        return True
+    except Exception:
+        return False
+
+
+def wait_for_page_ready(driver, quiet_period_ms=500, timeout=10, poll_interval=0.05):
+    """Wait until network and DOM are quiet, returning the seconds waited
+
+    Raises selenium's TimeoutException if the page never settles.
+    """
+    start = time.monotonic()
+    WebDriverWait(driver, timeout, poll_frequency=poll_interval).until(
+        lambda d: d.execute_script(PAGE_READY_JS, quiet_period_ms)
+    )
+    return time.monotonic() - start
+
+
+class WebDriverPool:
+    """Pool of headless browsers, each rendering one page at a time
+
+    Drivers are created lazily by ``factory`` up to ``size``, checked out for
+    a single page, and recycled after ``max_pages_per_driver`` pages or as
+    soon as a page fails with the driver checked out, so a crashed or
+    leaking Chrome is replaced instead of reused.
+    """
+
+    def __init__(self, factory, size=2, max_pages_per_driver=50):
+        self.factory = factory
+        self.size = size
+        self.max_pages_per_driver = max_pages_per_driver
+        self._idle = []
+        self._pages = {}
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        """Take an idle driver or create one, waiting while the pool is full"""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("WebDriver pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                self._cond.wait()
+
+        try:
+            driver = self.factory()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._pages[id(driver)] = 0
+        return driver
+
+    def _release(self, driver, healthy):
+        """Return a driver to the pool, or quit it when it is due for recycling"""
+        with self._cond:
+            pages = self._pages.get(id(driver), 0) + 1
+            recycle = self._closed or not healthy or pages >= self.max_pages_per_driver
+            if recycle:
+                self._pages.pop(id(driver), None)
+                self._created -= 1
+            else:
+                self._pages[id(driver)] = pages
+                self._idle.append(driver)
+            self._cond.notify()
+
+        if recycle:
+            self._quit(driver)
+
+    @contextmanager
+    def checkout(self):
+        """Check out a driver for one page; an exception discards the driver"""
+        driver = self._acquire()
+        healthy = False
+        try:
+            yield driver
+            healthy = True
+        finally:
+            self._release(driver, healthy)
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """Quit every idle driver; drivers checked out are quit on return"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            for driver in idle:
+                self._pages.pop(id(driver), None)
+            self._cond.notify_all()
+        for driver in idle:
+            self._quit(driver)
+
+
+class PageClassifier:
+    """Decide from a page's static HTML whether it needs a browser to render
+
+    Pages are routed to the browser when they carry an empty SPA mount point
+    (``#root``, ``#app``, ``ng-app``...), little visible text next to script
+    bundles of a client-side framework, a noscript "enable JavaScript"
+    notice, or inline scripts that load data with XHR/fetch. Verdicts are
+    remembered per URL template (host, directory with digits generalised,
+    extension); once ``min_samples`` pages of a template agree, later pages
+    reuse the verdict without inspection and dynamic ones skip the plain
+    HTTP fetch entirely. Only the first ``PREFIX_CHARS`` of a page are
+    inspected, so a large page is classified before it is fully downloaded.
+    """
+
+    PREFIX_CHARS = 256 * 1024
+    MOUNT_POINT = re.compile(
+        r'<(?:div|main|section|app-root)\b[^>]*\bid=["\'](?:root|app|__next|__nuxt|svelte|main-app)["\'][^>]*>\s*</',
+        re.IGNORECASE
+    )
+    FRAMEWORK_MARKER = re.compile(r'\b(?:ng-app|ng-version|data-reactroot|data-v-app|data-server-rendered)\b', re.IGNORECASE)
+    FRAMEWORK_BUNDLE = re.compile(
+        r'<script\b[^>]*\bsrc=["\'][^"\']*(?:react|vue|angular|ember|backbone|svelte|polyfills|'
+        r'runtime|vendor|chunk|bundle|main\.[0-9a-f]{6,}|app\.[0-9a-f]{6,})[^"\']*\.js',
+        re.IGNORECASE
+    )
+    NOSCRIPT_NOTICE = re.compile(r'<noscript\b[^>]*>[^<]*(?:enable|requires?)\s+javascript', re.IGNORECASE)
+    DATA_LOADER = re.compile(r'\bfetch\s*\(|\bXMLHttpRequest\b|\$\.(?:ajax|get|getJSON|post)\s*\(|\baxios\.')
+    INLINE_SCRIPT = re.compile(r'<script\b(?![^>]*\bsrc=)[^>]*>(.*?)</script>', re.IGNORECASE | re.DOTALL)
+    INVISIBLE = re.compile(r'<(script|style|template|noscript)\b.*?</\1\s*>|<!--.*?-->', re.IGNORECASE | re.DOTALL)
+    TAG = re.compile(r'<[^>]+>')
+
+    def __init__(self, min_text_chars=200, min_samples=3):
+        self.min_text_chars = min_text_chars
+        self.min_samples = min_samples
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def template_key(url):
+        """Reduce a URL to the template its pages are likely rendered from"""
+        parts = urlsplit(url)
+        directory, _, name = parts.path.rpartition('/')
+        extension = posixpath.splitext(name)[1].lower()
+        return parts.netloc.lower(), re.sub(r'\d+', '0', directory), extension
+
+    def remembered(self, url):
+        """Return the settled verdict for a URL's template (True = dynamic), or None"""
+        with self._lock:
+            verdict = self._templates.get(self.template_key(url))
+        if verdict and verdict[1] >= self.min_samples:
+            return verdict[0]
+        return None
+
+    def inspect(self, html):
+        """Return the reason static HTML needs a browser, or None if it does not"""
+        if self.MOUNT_POINT.search(html):
+            return 'empty mount point'
+        if self.NOSCRIPT_NOTICE.search(html):
+            return 'noscript notice'
+
+        text = self.TAG.sub(' ', self.INVISIBLE.sub(' ', html))
+        sparse = len(' '.join(text.split())) < self.min_text_chars
+        if sparse and (self.FRAMEWORK_MARKER.search(html) or self.FRAMEWORK_BUNDLE.search(html)):
+            return 'framework bundle without content'
+        if any(self.DATA_LOADER.search(script) for script in self.INLINE_SCRIPT.findall(html)):
+            return 'inline data loader'
+        return None
+
+    def needs_browser(self, url, html):
+        """Classify a page, using and updating the verdict for its template"""
+        dynamic = self.remembered(url)
+        if dynamic is None:
+            dynamic = self.inspect(html) is not None
+            key = self.template_key(url)
+            with self._lock:
+                previous = self._templates.get(key)
+                if previous and previous[0] == dynamic:
+                    self._templates[key] = (dynamic, previous[1] + 1)
+                else:
+                    # A disagreeing page restarts the template's count
+                    self._templates[key] = (dynamic, 1)
+        return dynamic
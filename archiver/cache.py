@@ -0,0 +1,206 @@
+# archiver/cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def default_image_cache_dir():
+    """Per-user image cache directory, shared by every archive of the user"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "website-archiver", "images")
+
+
+class AssetCache:
+    """Thread-safe LRU cache of processed assets, bounded by total size
+
+    Values are the final form an asset takes in a page (a data URL or inlined
+    CSS/JavaScript text), so a shared logo or stylesheet is downloaded,
+    compressed and encoded once per crawl instead of once per page.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sizeof(value):
+        """Approximate the memory held by a cached value"""
+        return len(value)
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value):
+        """Store a value, evicting least recently used entries to fit"""
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= self._sizeof(previous)
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._sizeof(evicted)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class ImageCache:
+    """Persistent cache of transcoded images: a SQLite index plus a blob directory
+
+    Keys combine a digest of the source bytes with the transcoding
+    parameters, so an image whose bytes and settings are unchanged since an
+    earlier run is never re-encoded. Blobs hold the encoded image itself and
+    the index its content type. Least recently used blobs are evicted
+    once the cache holds more than ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                mime TEXT
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(blobs)")]
+        if 'mime' not in columns:
+            # Index from before content types were stored; its rows read as misses
+            self._conn.execute("ALTER TABLE blobs ADD COLUMN mime TEXT")
+        self._conn.commit()
+        self.current_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    @staticmethod
+    def make_key(source, *params):
+        """Build a cache key from the source bytes and the parameters applied to them"""
+        content = hashlib.sha256(source).hexdigest()
+        settings = hashlib.sha256(repr(params).encode('utf-8')).hexdigest()[:16]
+        return f"{content}-{settings}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Return the cached (bytes, content type) for key, or None on a miss"""
+        with self._lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute("SELECT size, mime FROM blobs WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is None:
+                self._forget(key, row[0])
+                self._remove_blob(key)
+                row = None
+            if row is not None:
+                self._conn.execute("UPDATE blobs SET last_used = ? WHERE key = ?", (time.time(), key))
+        if row is None:
+            self.misses += 1
+            return None
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = f.read()
+        except OSError:
+            # Blob removed behind our back: forget it
+            with self._lock:
+                self._forget(key, row[0])
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value, row[1]
+
+    def put(self, key, value, content_type):
+        """Store bytes of a content type under key, evicting least recently used blobs to fit"""
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(value)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._conn is None:
+                return
+            previous = self._conn.execute("SELECT size FROM blobs WHERE key = ?", (key,)).fetchone()
+            if previous is not None:
+                self.current_bytes -= previous[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (key, size, last_used, mime) VALUES (?, ?, ?, ?)",
+                (key, len(value), time.time(), content_type)
+            )
+            self.current_bytes += len(value)
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete least recently used blobs until the cache fits; lock held"""
+        rows = self._conn.execute("SELECT key, size FROM blobs ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if self.current_bytes <= self.max_bytes:
+                break
+            self._forget(key, size)
+            self._remove_blob(key)
+
+    def _remove_blob(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _forget(self, key, size):
+        self._conn.execute("DELETE FROM blobs WHERE key = ?", (key,))
+        self.current_bytes -= size
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+
+    def close(self):
+        """Commit outstanding changes and close the index"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
@@ -3,6 +3,8 @@ import argparse
 import sys
 import time
 from archiver.core import WebsiteArchiver
+from archiver.browser import DEFAULT_BLOCKED_HOSTS
+from archiver.crawl import URLCanonicalizer
 import signal
 import os
 
@@ -24,6 +26,37 @@ def main():
     parser.add_argument("-q", "--quiet", help="Suppress progress output", action="store_true")
     parser.add_argument("--verify-ssl", help="Verify SSL certificates", action="store_true", default=True)
     parser.add_argument("--no-verify-ssl", help="Don't verify SSL certificates", action="store_false", dest="verify_ssl")
+    parser.add_argument("--max-depth", help="Maximum link depth to follow from the start URL", type=int, default=None)
+    parser.add_argument("--max-pages", help="Maximum number of pages to archive", type=int, default=None)
+    parser.add_argument("--bloom-visited", help="Track visited URLs in a fixed-size Bloom filter (for very large crawls)", action="store_true")
+    parser.add_argument("--resume", help="Continue an interrupted archive from the crawl journal in the output directory", action="store_true")
+    parser.add_argument("--drop-param", help="Query parameter pattern to strip from URLs (repeatable, e.g. 'sessionid*'); added to the built-in tracking list", action="append", default=[])
+    parser.add_argument("--strip-trailing-slash", help="Treat 'page/' and 'page' as the same URL", action="store_true")
+    parser.add_argument("--max-rps", help="Maximum requests per second to each host", type=float, default=None)
+    parser.add_argument("--host-concurrency", help="Upper bound for the adaptive per-host concurrency", type=int, default=None)
+    parser.add_argument("--browsers", help="Number of headless browsers rendering AJAX pages", type=int, default=2)
+    parser.add_argument("--browser-max-pages", help="Pages a browser renders before it is restarted", type=int, default=50)
+    parser.add_argument("--quiet-period", help="Milliseconds of network and DOM silence before a rendered page is captured", type=int, default=500)
+    parser.add_argument("--always-render", help="Render every page in a browser instead of only pages that need JavaScript", action="store_true")
+    parser.add_argument("--block-types", help="Comma-separated resource types the rendering browser skips (image, font, media, stylesheet); empty to allow all", default="image,font,media")
+    parser.add_argument("--block-host", help="Host the rendering browser never contacts (repeatable); added to the built-in tracker list", action="append", default=[])
+    parser.add_argument("--parser", help="HTML parser backend (default: lxml when installed)", choices=["lxml", "html.parser", "html5lib"], default=None)
+    parser.add_argument("--stream-threshold-mb", help="Rewrite pages larger than this as a stream, without holding them in memory (0 = never)", type=float, default=5)
+    parser.add_argument("--no-gzip-html", help="Save large pages as plain HTML instead of .html.gz", action="store_false", dest="gzip_html")
+    parser.add_argument("--cpu-workers", help="Worker processes for image transcoding and gzip (0 = in the download threads; try the number of cores)", type=int, default=0)
+    parser.add_argument("--image-formats", help="Comma-separated image output formats to try, smallest wins (webp, avif, jpeg)", default="webp,jpeg")
+    parser.add_argument("--image-dpr", help="Device pixel ratio kept when scaling images down to their display size", type=float, default=2)
+    parser.add_argument("--no-downscale", help="Keep images at full resolution", action="store_false", dest="downscale_images")
+    parser.add_argument("--image-cache-dir", help="Persistent cache of transcoded images (default: ~/.cache/website-archiver/images)", default=None)
+    parser.add_argument("--image-cache-mb", help="Disk budget of the persistent image cache (0 = disabled)", type=int, default=1024)
+    parser.add_argument("--asset-mode", help="inline: embed assets in every page; external: write each once to assets/ and link to it", choices=["inline", "external"], default="inline")
+    parser.add_argument("--output-format", help="files: rewritten pages and assets; warc: raw HTTP records in WARC files; wacz: WARC packaged with a CDX index", choices=["files", "warc", "wacz"], default="files")
+    parser.add_argument("--warc-max-mb", help="Start a new WARC file once the current one reaches this size", type=int, default=1024)
+    parser.add_argument("--engine", help="Crawl engine: worker threads or a single asyncio event loop", choices=["thread", "async"], default="thread")
+    parser.add_argument("--concurrency", help="Maximum in-flight requests for the async engine", type=int, default=100)
+    parser.add_argument("--asset-workers", help="Concurrent asset downloads per page (1 = sequential)", type=int, default=8)
+    parser.add_argument("--asset-cache-mb", help="Memory budget for processed assets shared across pages (0 = disabled)", type=int, default=256)
+    parser.add_argument("--pool-size", help="Keep-alive connections per host (default: max(threads + asset workers, 10))", type=int, default=None)
     
     args = parser.parse_args()
     
@@ -35,14 +68,60 @@ def main():
     try:
         print(f"Starting archive of {args.url}")
         print(f"Output directory: {args.output or os.path.expanduser('~/website_archives')}")
-        print(f"Using {args.threads} threads")
         
-        archiver = WebsiteArchiver(
-            args.url,
-            args.output,
-            args.threads
+        options = dict(
+            max_depth=args.max_depth,
+            max_pages=args.max_pages,
+            visited_mode="bloom" if args.bloom_visited else "exact",
+            resume=args.resume,
+            browser_pool_size=args.browsers,
+            browser_max_pages=args.browser_max_pages,
+            quiet_period_ms=args.quiet_period,
+            classify_pages=not args.always_render,
+            html_parser=args.parser,
+            stream_threshold_mb=args.stream_threshold_mb,
+            gzip_html=args.gzip_html,
+            cpu_workers=args.cpu_workers,
+            image_formats=[f.strip() for f in args.image_formats.split(",") if f.strip()],
+            image_dpr=args.image_dpr,
+            downscale_images=args.downscale_images,
+            image_cache_dir=args.image_cache_dir,
+            image_cache_mb=args.image_cache_mb,
+            asset_mode=args.asset_mode,
+            output_format=args.output_format,
+            warc_max_mb=args.warc_max_mb,
+            block_resource_types=[t.strip() for t in args.block_types.split(",") if t.strip()],
+            block_hosts=DEFAULT_BLOCKED_HOSTS + tuple(args.block_host),
+            max_rps_per_host=args.max_rps,
+            max_host_concurrency=args.host_concurrency,
+            canonicalizer=URLCanonicalizer(
+                drop_params=URLCanonicalizer.DEFAULT_DROP_PARAMS + tuple(args.drop_param),
+                strip_trailing_slash=args.strip_trailing_slash
+            ),
+            verify_ssl=args.verify_ssl,
+            asset_cache_mb=args.asset_cache_mb,
+            pool_maxsize=args.pool_size
         )
         
+        if args.engine == "async":
+            from archiver.async_core import AsyncWebsiteArchiver
+            print(f"Using async engine with up to {args.concurrency} concurrent requests")
+            archiver = AsyncWebsiteArchiver(
+                args.url,
+                args.output,
+                max_concurrency=args.concurrency,
+                **options
+            )
+        else:
+            print(f"Using {args.threads} threads")
+            archiver = WebsiteArchiver(
+                args.url,
+                args.output,
+                args.threads,
+                asset_workers=args.asset_workers,
+                **options
+            )
+        
         success = archiver.start_archive(
             None if args.quiet else progress_callback
         )
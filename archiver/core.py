@@ -1,50 +1,229 @@
 # archiver/core.py
 import os
 import logging
-import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlparse, urldefrag
+import posixpath
 import threading
-from queue import Queue
+from queue import Queue, Empty
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
 import time
 from pathlib import Path
 import mimetypes
 import re
 import base64
-from io import BytesIO
+import hashlib
 import gzip
 import zlib
+import itertools
+import math
+from functools import partial
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import json
-from PIL import Image
+from archiver.fetch import Fetcher, HostScheduler, SingleFlight, build_response, parse_retry_after
+from archiver.browser import (
+    DEFAULT_BLOCKED_HOSTS, DEFAULT_BLOCKED_TYPES, NETWORK_TRACKER_JS, PageClassifier, WebDriverPool,
+    block_resources, blocked_content_settings, blocked_url_patterns, install_network_tracker, wait_for_page_ready
+)
+from archiver.assets import ASSET_DIR, AssetStore, relative_reference
+from archiver.cache import AssetCache, ImageCache, default_image_cache_dir
+from archiver.crawl import CrawlJournal, URLCanonicalizer, create_visited_set
+from archiver.parse import ParsedPage, parse_srcset, resolve_parser
+from archiver.streaming import STREAM_CHUNK_SIZE, StreamingRewriter, format_start_tag, iter_chunks
+from archiver.warc import WarcWriter
+from archiver.transform import IMAGE_FORMATS, compress_image_data, to_data_url, transcode_image
+
+# Lazy-loading scripts keep the real image in these until it scrolls into view
+LAZY_SRC_ATTRIBUTES = ('data-src', 'data-lazy-src', 'data-original')
+LAZY_SRCSET_ATTRIBUTES = ('data-srcset', 'data-lazy-srcset')
+# <picture><source type> values every current browser decodes
+SUPPORTED_SOURCE_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/avif', 'image/svg+xml')
+# CSS width of the rendering browser window, for srcset sizes and media queries
+VIEWPORT_WIDTH = 1920
+MEDIA_WIDTH_PATTERN = re.compile(r'^\(\s*(min|max)-width\s*:\s*(\d+(?:\.\d+)?)px\s*\)$', re.IGNORECASE)
+# A length in CSS pixels, as in width="300" or max-width: 300px
+PIXELS_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(?:px)?\s*(?:!important)?\s*$', re.IGNORECASE)
+CSS_URL_PATTERN = re.compile(r'url\([\'"]?([^\'"()]+)[\'"]?\)')
+# Elements still showing a loading state once a rendered page has settled
+PLACEHOLDER_CLASS_PATTERN = re.compile(
+    r'\bclass\s*=\s*["\'][^"\']*(?:loading|skeleton|placeholder)', re.IGNORECASE
+)
+
+def _css_pixels(value):
+    """Parse a pixel length, or None for anything else (%, em, auto...)"""
+    match = PIXELS_PATTERN.match(value) if value else None
+    return float(match.group(1)) if match else None
+
+def _is_fetchable_reference(ref):
+    """Check if a URL reference resolves to something an image can be loaded from"""
+    try:
+        scheme = urlparse(ref).scheme.lower()
+    except ValueError:
+        return False
+    return scheme in ('', 'http', 'https', 'data')
+
+def _media_matches(media):
+    """Evaluate a min-width/max-width media query against the viewport; anything else does not match"""
+    for condition in re.split(r'\s+and\s+', media.strip(), flags=re.IGNORECASE):
+        match = MEDIA_WIDTH_PATTERN.match(condition.strip())
+        if not match:
+            return False
+        bound = float(match.group(2))
+        if match.group(1).lower() == 'min' and VIEWPORT_WIDTH < bound:
+            return False
+        if match.group(1).lower() == 'max' and VIEWPORT_WIDTH > bound:
+            return False
+    return True
 
 class WebsiteArchiver:
     def __init__(self, base_url, output_dir=None, max_threads=5, compress_images=True, 
-                 wait_for_ajax=True, max_image_size_kb=500, compression_quality=95):
-        self.base_url = base_url
-        self.domain = urlparse(base_url).netloc
+                 wait_for_ajax=True, max_image_size_kb=500, compression_quality=95,
+                 verify_ssl=True, pool_connections=10, pool_maxsize=None, request_timeout=30,
+                 asset_workers=8, asset_cache_mb=256, max_depth=None, max_pages=None,
+                 visited_mode='exact', visited_capacity=10_000_000, journal=True, resume=False,
+                 canonicalizer=None, max_rps_per_host=None, max_host_concurrency=None,
+                 latency_target=None, throttle_retries=2, browser_pool_size=2, browser_max_pages=50,
+                 quiet_period_ms=500, render_timeout=10, classify_pages=True,
+                 block_resource_types=DEFAULT_BLOCKED_TYPES, block_hosts=DEFAULT_BLOCKED_HOSTS,
+                 html_parser=None, stream_threshold_mb=5, gzip_html=True, cpu_workers=0,
+                 image_formats=('webp', 'jpeg'), downscale_images=True, image_dpr=2,
+                 image_cache_dir=None, image_cache_mb=1024, asset_mode='inline',
+                 output_format='files', warc_max_mb=1024):
+        # Every URL is compared, queued and cached in canonical form, so the
+        # scope prefix and domain are derived from the canonical start URL
+        self.canonicalize = canonicalizer or URLCanonicalizer()
+        self.base_url = self.canonicalize(base_url)
+        self.domain = urlparse(self.base_url).netloc
         self.output_dir = output_dir or os.path.join(os.path.expanduser("~"), "website_archives")
-        self.visited_urls = set()
+        # 'bloom' trades exactness for fixed memory on very large crawls
+        self.visited_urls = create_visited_set(visited_mode, visited_capacity)
         self.queue = Queue()
+        # Crawl frontier: every URL ever queued, bounded by depth and page count
+        self.discovered_urls = create_visited_set(visited_mode, visited_capacity)
+        self._frontier_lock = threading.Lock()
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        # SQLite journal of the frontier so an interrupted crawl can resume
+        self.use_journal = journal or resume
+        self.resume = resume
+        self.journal = None
         self.max_threads = max_threads
         self.active = True
         self.compress_images = compress_images
         self.wait_for_ajax = wait_for_ajax
-        self.ajax_data = {}
         self.max_image_size_kb = max_image_size_kb
         self.compression_quality = compression_quality
+        # Candidate output formats, smallest wins; images are scaled down to
+        # their rendered size times image_dpr for high density screens
+        self.image_formats = tuple(image_formats)
+        unknown = [name for name in self.image_formats if name not in IMAGE_FORMATS]
+        if unknown:
+            raise ValueError(f"Unknown image format: {', '.join(unknown)}")
+        self.downscale_images = downscale_images
+        self.image_dpr = image_dpr
+        # Transcoded images kept across runs (0 MB = disabled), opened on first
+        # use; per user by default so the blobs stay out of the served archive
+        # and runs into fresh output directories still hit
+        self.image_cache_dir = image_cache_dir or default_image_cache_dir()
+        self.image_cache_mb = image_cache_mb
+        self._image_cache = None
+        self._image_cache_lock = threading.Lock()
+        self.images_compressed = 0
+        self.image_encodes = 0
+        self._image_stats_lock = threading.Lock()
+        # BeautifulSoup backend for every page parse; lxml unless unavailable
+        self.html_parser = resolve_parser(html_parser)
+        # Pages above this many characters are rewritten as a token stream
+        self.stream_threshold = int(stream_threshold_mb * 1024 * 1024) if stream_threshold_mb else None
+        self.gzip_html = gzip_html
+        
+        # Shared keep-alive connection pools for every download, sized for
+        # the page workers plus the asset threads
+        self.fetcher = Fetcher(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize or max(max_threads + max(asset_workers, 1), 10),
+            timeout=request_timeout,
+            verify=verify_ssl
+        )
+        # Politeness between the frontier and the network: per-host rate cap,
+        # Retry-After and concurrency adapted to latency and errors
+        self.scheduler = HostScheduler(
+            max_rps=max_rps_per_host,
+            max_concurrency=max_host_concurrency or max_threads + max(asset_workers, 1),
+            latency_target=latency_target
+        )
+        self.throttle_retries = throttle_retries
+        # Concurrent fetches of the same URL share one download
+        self._single_flight = SingleFlight()
+        # Responses fetched ahead of a page rewrite, per processing thread
+        self._page_local = threading.local()
+        # Pool resolving a page's assets concurrently (0 or 1 = sequential)
+        self.asset_workers = asset_workers
+        self._asset_pool = None
+        self._asset_pool_lock = threading.Lock()
+        # Processes for image transcoding and gzip, off the GIL (0 = in-thread)
+        self.cpu_workers = cpu_workers
+        self._cpu_pool = None
+        self._cpu_pool_lock = threading.Lock()
+        # Processed assets shared across pages, keyed by (kind, absolute URL)
+        self.asset_cache = AssetCache(max_bytes=asset_cache_mb * 1024 * 1024)
+        # 'inline' embeds assets into every page, 'external' writes each once
+        # to assets/<sha256>.<ext> and links to it by relative path
+        if asset_mode not in ('inline', 'external'):
+            raise ValueError(f"Unknown asset mode: {asset_mode}")
+        self.asset_mode = asset_mode
+        self.asset_store = AssetStore(self.output_dir) if asset_mode == 'external' else None
+        # 'warc' and 'wacz' record every raw HTTP exchange into rotating
+        # WARC files under warc/ instead of writing rewritten loose files
+        if output_format not in ('files', 'warc', 'wacz'):
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.output_format = output_format
+        self.warc_writer = None
+        if output_format != 'files':
+            self.warc_writer = WarcWriter(
+                os.path.join(self.output_dir, "warc"),
+                prefix=re.sub(r'[^\w.-]', '_', self.domain) or 'archive',
+                max_size=warc_max_mb * 1024 * 1024
+            )
         
         # Setup logging
         self.setup_logging()
         
-        # Initialize webdriver for AJAX handling if needed
+        # Browser pool for AJAX handling, sized independently of max_threads
+        self.browser_pool_size = browser_pool_size
+        self.browser_max_pages = browser_max_pages
+        self.quiet_period_ms = quiet_period_ms
+        self.render_timeout = render_timeout
+        self.render_wait_seconds = 0.0
+        self.rendered_pages = 0
+        self._render_stats_lock = threading.Lock()
+        # Fetch pages over plain HTTP first and render only those that need it
+        self.classifier = PageClassifier() if classify_pages else None
+        # Requests the rendering browser never makes (images, fonts, trackers...)
+        self.blocked_url_patterns = blocked_url_patterns(block_resource_types or (), block_hosts or ())
+        self.blocked_content_settings = blocked_content_settings(block_resource_types or ())
+        self.static_pages = 0
+        self.driver_pool = None
         if self.wait_for_ajax:
             self.setup_webdriver()
 
+    @property
+    def driver(self):
+        """The browser pool when AJAX capture is enabled, otherwise None"""
+        return self.driver_pool if self.wait_for_ajax else None
+
     def setup_webdriver(self):
+        """Create the pool of headless browsers; each starts on first use"""
+        self.driver_pool = WebDriverPool(
+            self._create_webdriver,
+            size=self.browser_pool_size,
+            max_pages_per_driver=self.browser_max_pages
+        )
+
+    def _create_webdriver(self):
         """Initialize Selenium WebDriver with appropriate options"""
         try:
             chrome_options = Options()
@@ -54,14 +233,24 @@ class WebsiteArchiver:
             chrome_options.add_argument("--disable-dev-shm-usage")
             chrome_options.add_argument("--enable-javascript")
             chrome_options.add_argument("--window-size=1920,1080")
-            
-            self.driver = webdriver.Chrome(options=chrome_options)
-            self.driver.set_page_load_timeout(30)
+            # Network events, needed to read response bodies back over CDP
+            chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+            if self.blocked_content_settings:
+                # Blocks by resource type, whatever the URL looks like
+                chrome_options.add_experimental_option('prefs', self.blocked_content_settings)
+            
+            driver = webdriver.Chrome(options=chrome_options)
+            driver.set_page_load_timeout(30)
+            driver.network_tracker_installed = install_network_tracker(driver)
+            if not block_resources(driver, self.blocked_url_patterns):
+                self.logger.warning("Resource blocking unavailable; the browser downloads everything")
             self.logger.info("WebDriver initialized successfully")
+            return driver
         except Exception as e:
+            # Without a browser every page falls back to plain requests
             self.logger.error(f"Failed to initialize WebDriver: {str(e)}")
             self.wait_for_ajax = False
-            self.driver = None
+            raise
 
     def setup_logging(self):
         """Configure logging system"""
@@ -91,17 +280,66 @@ class WebsiteArchiver:
 
     def __del__(self):
         """Cleanup resources"""
-        if hasattr(self, 'driver') and self.driver:
+        if getattr(self, 'driver_pool', None):
+            self.driver_pool.close()
+        if hasattr(self, 'fetcher'):
+            self.fetcher.close()
+
+    def fetch(self, url, **kwargs):
+        """Download a URL through the shared connection pool"""
+        prefetched = getattr(self._page_local, 'responses', None)
+        if prefetched and url in prefetched:
+            result = prefetched[url]
+            if isinstance(result, Exception):
+                raise result
+            return result
+        if kwargs:
+            return self._scheduled_fetch(url, **kwargs)
+        return self._single_flight.do(url, lambda: self._scheduled_fetch(url))
+
+    def _scheduled_fetch(self, url, **kwargs):
+        """Fetch a URL once the host scheduler allows it, retrying when throttled"""
+        host = urlparse(url).netloc
+        for attempt in range(self.throttle_retries + 1):
+            self.scheduler.acquire(host)
+            start = time.monotonic()
             try:
-                self.driver.quit()
-            except:
-                pass
+                response = self.fetcher.fetch(url, **kwargs)
+            except Exception:
+                self.scheduler.release(host, error=True)
+                raise
+            
+            retry_after = parse_retry_after(response.headers.get('retry-after'))
+            self.scheduler.release(host, response.status_code, time.monotonic() - start, retry_after,
+                                   attempt=attempt)
+            
+            if (response.status_code not in HostScheduler.THROTTLE_STATUSES
+                    or self._retry_after_exceeds_cap(url, retry_after)
+                    or attempt == self.throttle_retries):
+                if not kwargs.get('stream'):
+                    self._record_exchange(response)
+                return response
+            # Give a streamed body's pooled connection back before retrying
+            response.close()
+            self.logger.warning(
+                f"Throttled by {host} ({response.status_code}), retrying {url} "
+                f"with concurrency {self.scheduler.limit(host)}"
+            )
+
+    def _retry_after_exceeds_cap(self, url, retry_after):
+        """Check if a throttled URL asks for a longer wait than the scheduler allows; it then fails"""
+        cap = self.scheduler.max_retry_backoff
+        if retry_after is None or retry_after <= cap:
+            return False
+        self.logger.warning(
+            f"Retry-After of {retry_after:.0f}s exceeds the {cap:.0f}s cap, giving up on {url}"
+        )
+        return True
 
     def start_archive(self, progress_callback=None):
         """Start the archiving process"""
         try:
-            self.visited_urls.clear()
-            self.queue.put(self.base_url)
+            self._seed_frontier()
             
             # Create worker threads
             threads = []
@@ -120,6 +358,28 @@ class WebsiteArchiver:
                 t.join()
                 
             self.logger.info(f"Archive complete. Total pages: {len(self.visited_urls)}")
+            self.logger.info(f"Asset cache: {self.asset_cache.hits} hits, {self.asset_cache.misses} misses")
+            self.logger.info(f"Duplicate in-flight fetches avoided: {self._single_flight.shared}")
+            if self.rendered_pages:
+                self.logger.info(
+                    f"Rendered {self.rendered_pages} pages, average readiness wait "
+                    f"{self.render_wait_seconds / self.rendered_pages:.2f}s"
+                )
+            if self.classifier:
+                self.logger.info(f"Pages that skipped the browser: {self.static_pages}")
+            if self._image_cache is not None:
+                self.logger.info(
+                    f"Persistent image cache: {self._image_cache.hits} hits, {self._image_cache.misses} misses"
+                )
+            if self.asset_store is not None:
+                self.logger.info(
+                    f"External assets: {self.asset_store.written} written, {self.asset_store.reused} reused"
+                )
+            if self.images_compressed:
+                self.logger.info(
+                    f"Recompressed {self.images_compressed} images, "
+                    f"{self.image_encodes / self.images_compressed:.1f} encodes per image"
+                )
             return True
             
         except Exception as e:
@@ -127,230 +387,741 @@ class WebsiteArchiver:
             return False
             
         finally:
-            if hasattr(self, 'driver') and self.driver:
-                self.driver.quit()
+            if self.driver_pool:
+                self.driver_pool.close()
+            self._shutdown_asset_pool()
+            self._shutdown_cpu_pool()
+            self._close_image_cache()
+            self._close_warc()
+            self._close_journal()
+            self.fetcher.close()
+
+    def _seed_frontier(self):
+        """Reset crawl state and queue the start URL, or the journal's pending URLs on resume"""
+        self.visited_urls.clear()
+        self.discovered_urls.clear()
+        
+        if self.use_journal:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.journal = CrawlJournal(os.path.join(self.output_dir, "crawl_state.sqlite3"))
+            if not self.resume:
+                self.journal.reset()
+        
+        pending = []
+        if self.journal and self.resume:
+            for url, depth, status in self.journal.entries():
+                self.discovered_urls.add(url)
+                if status == CrawlJournal.DONE:
+                    self.visited_urls.add(url)
+                else:
+                    # Queued when interrupted, or failed: try again
+                    pending.append((url, depth))
+            self.logger.info(f"Resuming crawl: {len(self.visited_urls)} pages done, {len(pending)} pending")
+        
+        if pending:
+            for url, depth in pending:
+                self._put_frontier(url, depth)
+        elif not len(self.visited_urls):
+            self._enqueue(self.base_url, 0)
+
+    def _close_journal(self):
+        """Flush and close the crawl journal"""
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def _get_asset_pool(self):
+        """Return the shared asset download pool, creating it on first use"""
+        with self._asset_pool_lock:
+            if self._asset_pool is None:
+                self._asset_pool = ThreadPoolExecutor(
+                    max_workers=self.asset_workers,
+                    thread_name_prefix="asset"
+                )
+            return self._asset_pool
+
+    def _shutdown_asset_pool(self):
+        """Stop the asset download pool"""
+        with self._asset_pool_lock:
+            pool, self._asset_pool = self._asset_pool, None
+        if pool:
+            pool.shutdown(wait=True)
+
+    def _get_image_cache(self):
+        """Return the persistent image cache, opening it on first use; None if disabled"""
+        if not self.image_cache_mb or not self.compress_images:
+            return None
+        with self._image_cache_lock:
+            if self._image_cache is None:
+                self._image_cache = ImageCache(self.image_cache_dir, self.image_cache_mb * 1024 * 1024)
+            return self._image_cache
+
+    def _close_image_cache(self):
+        """Close the persistent image cache"""
+        with self._image_cache_lock:
+            cache, self._image_cache = self._image_cache, None
+        if cache is not None:
+            cache.close()
+
+    def _record_exchange(self, response, request_headers=None):
+        """Append a fetched response and its request to the WARC output, if enabled"""
+        if self.warc_writer is None:
+            return
+        if request_headers is None:
+            request = getattr(response, 'request', None)
+            request_headers = request.headers if request is not None else self.fetcher.headers
+        try:
+            self.warc_writer.write_exchange(
+                response.url, response.status_code, response.headers, response.content,
+                reason=response.reason, request_headers=request_headers
+            )
+        except Exception as e:
+            self.logger.error(f"Error writing WARC record for {response.url}: {str(e)}")
+
+    def _is_recorded(self, url):
+        """Check if a URL is already in the WARC output"""
+        return self.warc_writer is not None and self.warc_writer.has_record(url)
+
+    def _record_asset(self, url, kind):
+        """Fetch an asset only for its WARC record, following a stylesheet's url() references"""
+        if self._is_recorded(url):
+            return
+        response = self.fetch(url)
+        if kind == 'css' and response.ok:
+            for css_url in self._collect_css_urls(url, response.text):
+                self._fetch_or_error(css_url)
+
+    def _close_warc(self):
+        """Close the WARC output, packaging it as a WACZ when requested"""
+        writer, self.warc_writer = self.warc_writer, None
+        if writer is None:
+            return
+        try:
+            if self.output_format == 'wacz':
+                path = writer.package_wacz(os.path.join(self.output_dir, "archive.wacz"), title=self.base_url)
+                self.logger.info(f"Packaged {writer.records} records into {path}")
+            else:
+                writer.close()
+                self.logger.info(f"Wrote {writer.records} WARC records to {writer.directory}")
+        except Exception as e:
+            self.logger.error(f"Error closing WARC output: {str(e)}")
+
+    def _get_cpu_pool(self):
+        """Return the process pool for CPU-bound stages, creating it on first use"""
+        with self._cpu_pool_lock:
+            if self._cpu_pool is None:
+                # spawn: forking a process full of threads can copy held locks
+                self._cpu_pool = ProcessPoolExecutor(
+                    max_workers=self.cpu_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._cpu_pool
+
+    def _shutdown_cpu_pool(self):
+        """Stop the CPU process pool"""
+        with self._cpu_pool_lock:
+            pool, self._cpu_pool = self._cpu_pool, None
+        if pool:
+            pool.shutdown(wait=True)
+
+    def _run_cpu(self, fn, *args):
+        """Run a picklable CPU-bound function in the process pool, or inline without one"""
+        if self.cpu_workers > 0:
+            # The calling thread waits without holding the GIL
+            return self._get_cpu_pool().submit(fn, *args).result()
+        return fn(*args)
+
     def _worker(self, progress_callback=None):
         """Worker thread for processing URLs"""
-        while self.active:
+        while True:
             try:
-                url = self.queue.get(timeout=1)
-                if url not in self.visited_urls:
-                    self._process_url(url, progress_callback)
-                self.queue.task_done()
-            except Queue.Empty:
+                url, depth = self.queue.get(timeout=1)
+            except Empty:
+                if not self.active:
+                    break
                 continue
+            
+            try:
+                # Once stopped, drain the queue so start_archive can return
+                if self.active and url not in self.visited_urls:
+                    self._process_url(url, progress_callback, depth)
             except Exception as e:
                 self.logger.error(f"Worker error: {str(e)}")
+            finally:
                 self.queue.task_done()
 
-    def capture_ajax_content(self, url):
-        """Capture dynamically loaded content using Selenium"""
-        if not self.driver:
+    def _enqueue(self, url, depth):
+        """Add a URL to the crawl frontier
+
+        Returns True if the URL is (or already was) part of the archive, so
+        links to it can be rewritten to the local copy.
+        """
+        with self._frontier_lock:
+            if url in self.discovered_urls:
+                return True
+            if self.max_depth is not None and depth > self.max_depth:
+                return False
+            if self.max_pages is not None and len(self.discovered_urls) >= self.max_pages:
+                return False
+            self.discovered_urls.add(url)
+        if self.journal:
+            self.journal.record_queued(url, depth)
+        self._put_frontier(url, depth)
+        return True
+
+    def _put_frontier(self, url, depth):
+        """Hand a newly discovered URL to the workers"""
+        self.queue.put((url, depth))
+
+    def _resolve(self, base_url, ref):
+        """Resolve a reference against a page into a canonical absolute URL"""
+        return self.canonicalize(urljoin(base_url, ref.strip()))
+
+    def _normalize_link(self, base_url, href):
+        """Resolve a link to a canonical absolute URL, or None for non-HTTP links"""
+        absolute_url = urljoin(base_url, href.strip())
+        if urlparse(absolute_url).scheme not in ('http', 'https'):
+            return None
+        return self.canonicalize(absolute_url)
+
+    def _should_crawl(self, url):
+        """Check if a discovered link is inside the archive scope, whether or not it was visited"""
+        return url.startswith(self.base_url) and self._is_archivable(url)
+
+    def capture_ajax_content(self, url, responses=None, ajax_data=None):
+        """Capture dynamically loaded content using a pooled Selenium browser
+
+        If ``ajax_data`` is a dict, it is filled with the page's XHR/fetch
+        bodies keyed by URL. If ``responses`` is a dict, it is filled with the
+        other in-scope resources the browser downloaded, keyed by canonical
+        URL, so the page rewrite does not fetch them again.
+        """
+        if not self.driver_pool or not self.wait_for_ajax:
             return None
             
         try:
-            self.driver.get(url)
-            
-            # Wait for initial page load
-            time.sleep(2)
+            with self.driver_pool.checkout() as driver:
+                return self._render_page(driver, url, responses, ajax_data)
             
-            # Wait for dynamic content
+        except Exception as e:
+            self.logger.error(f"Error capturing AJAX content: {str(e)}")
+            return None
+
+    def _render_page(self, driver, url, responses=None, ajax_data=None):
+        """Render a page in a checked-out browser and return the final HTML"""
+        # Drop what a pooled browser logged after its previous page settled
+        # (polling, beacons), so only this page's responses are collected
+        driver.get_log('performance')
+        driver.get(url)
+        if not getattr(driver, 'network_tracker_installed', False):
+            # No CDP: track from now on, missing requests of the initial load
+            driver.execute_script(NETWORK_TRACKER_JS)
+        
+        # Return as soon as network and DOM have been quiet long enough
+        start = time.monotonic()
+        try:
+            wait_for_page_ready(driver, self.quiet_period_ms, self.render_timeout)
+        except Exception:
+            self.logger.warning(f"Timeout waiting for dynamic content on {url}")
+        waited = time.monotonic() - start
+        with self._render_stats_lock:
+            self.render_wait_seconds += waited
+            self.rendered_pages += 1
+        self.logger.info(f"Page ready after waiting {waited:.2f}s: {url}")
+        
+        # Read the bodies the browser received instead of downloading them again
+        self._collect_browser_responses(driver, responses, ajax_data)
+        
+        # Get final HTML after JavaScript execution
+        final_html = driver.page_source
+        
+        # Look for any remaining dynamic placeholders without parsing the page twice
+        loading_elements = len(PLACEHOLDER_CLASS_PATTERN.findall(final_html))
+        if loading_elements:
+            self.logger.warning(f"Found {loading_elements} potentially unloaded elements on {url}")
+        
+        return final_html
+
+    def _collect_browser_responses(self, driver, responses=None, ajax_data=None):
+        """Pull in-scope response bodies out of the browser over CDP"""
+        for entry in driver.get_log('performance'):
             try:
-                WebDriverWait(self.driver, 10).until(
-                    lambda driver: driver.execute_script("""
-                        return (
-                            // jQuery
-                            (typeof jQuery === 'undefined' || jQuery.active === 0) &&
-                            // Fetch API
-                            !window._fetchActive &&
-                            // XHR
-                            !window._xhrActive
-                        );
-                    """)
-                )
-            except:
-                self.logger.warning(f"Timeout waiting for dynamic content on {url}")
-            
-            # Inject tracking for future XHR/Fetch requests
-            self.driver.execute_script("""
-                // Track XHR requests
-                window._xhrActive = false;
-                (function(open) {
-                    XMLHttpRequest.prototype.open = function() {
-                        window._xhrActive = true;
-                        this.addEventListener('loadend', function() {
-                            window._xhrActive = false;
-                        });
-                        return open.apply(this, arguments);
-                    };
-                })(XMLHttpRequest.prototype.open);
-                
-                // Track Fetch requests
-                window._fetchActive = false;
-                (function(fetch) {
-                    window.fetch = function() {
-                        window._fetchActive = true;
-                        return fetch.apply(this, arguments).finally(() => {
-                            window._fetchActive = false;
-                        });
-                    };
-                })(window.fetch);
-            """)
-            
-            # Capture network requests
-            ajax_urls = set()
-            performance_logs = self.driver.get_log('performance')
-            
-            for log in performance_logs:
-                if 'Network.responseReceived' in str(log):
-                    try:
-                        url_data = json.loads(log['message'])
-                        if 'params' in url_data and 'response' in url_data['params']:
-                            response_url = url_data['params']['response']['url']
-                            if self._should_download(response_url) and '.js' not in response_url:
-                                ajax_urls.add(response_url)
-                    except:
-                        continue
-            
-            # Get content for each AJAX URL
-            for ajax_url in ajax_urls:
-                try:
-                    response = requests.get(ajax_url)
-                    if response.ok:
-                        self.ajax_data[ajax_url] = response.text
-                except Exception as e:
-                    self.logger.error(f"Error capturing AJAX content from {ajax_url}: {str(e)}")
+                message = json.loads(entry['message'])['message']
+                if message.get('method') != 'Network.responseReceived':
+                    continue
+                params = message['params']
+                response = params['response']
+                response_url = response['url']
+                resource_type = params.get('type')
+                status = int(response.get('status', 0))
+            except (KeyError, TypeError, ValueError):
+                continue
             
-            # Get final HTML after JavaScript execution
-            final_html = self.driver.page_source
+            if not 200 <= status < 300 or not self.canonicalize(response_url).startswith(self.base_url):
+                continue
+            # The document is only kept as the page's WARC record
+            is_document = resource_type == 'Document'
+            if is_document and self.warc_writer is None:
+                continue
+            if not is_document and not self._should_download(response_url):
+                continue
+            is_ajax = resource_type in ('XHR', 'Fetch')
+            target = ajax_data if is_ajax else responses
+            if target is None and self.warc_writer is None:
+                continue
             
-            # Look for any remaining dynamic placeholders
-            soup = BeautifulSoup(final_html, 'html.parser')
-            loading_elements = soup.find_all(class_=re.compile(r'loading|skeleton|placeholder'))
-            if loading_elements:
-                self.logger.warning(f"Found {len(loading_elements)} potentially unloaded elements on {url}")
+            try:
+                result = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': params['requestId']})
+            except Exception as e:
+                # Body no longer held by the browser; the rewrite fetches it instead
+                self.logger.warning(f"Browser body unavailable for {response_url}: {str(e)}")
+                continue
             
-            return final_html
+            if result.get('base64Encoded'):
+                captured = build_response(response_url, status, response.get('headers'),
+                                          base64.b64decode(result['body']))
+            else:
+                captured = build_response(response_url, status, response.get('headers'),
+                                          result['body'].encode('utf-8'), encoding='utf-8')
+            self._record_exchange(captured, response.get('requestHeaders'))
             
-        except Exception as e:
-            self.logger.error(f"Error capturing AJAX content: {str(e)}")
-            return None
+            if is_document or target is None:
+                continue
+            if is_ajax:
+                ajax_data[response_url] = captured.text
+            else:
+                responses[self.canonicalize(response_url)] = captured
 
     def compress_image(self, img_data):
-        """Compress image data while maintaining quality"""
+        """Compress image data as JPEG while maintaining quality
+
+        Kept for callers compressing standalone images; pages go through
+        _transcode_image, which also downscales and picks the format.
+        """
         try:
-            # Convert binary data to PIL Image
-            img = Image.open(BytesIO(img_data))
-            
-            # If image is already small enough, return original
-            if len(img_data) < self.max_image_size_kb * 1024:
-                return img_data
-            
-            # Calculate target size
-            target_size = self.max_image_size_kb * 1024
-            quality = self.compression_quality
-            output = BytesIO()
-            
-            # Try different quality levels to get desired size
-            while quality > 30:  # Don't go below quality 30
-                output.seek(0)
-                output.truncate()
-                
-                if img.mode in ('RGBA', 'LA'):
-                    # Handle transparency
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[-1])
-                    background.save(output, 'JPEG', 
-                                 quality=quality, 
-                                 optimize=True,
-                                 progressive=True)
-                else:
-                    img.save(output, 'JPEG', 
-                           quality=quality, 
-                           optimize=True,
-                           progressive=True)
-                
-                if output.tell() <= target_size:
-                    break
-                
-                quality -= 5
-            
-            compressed_size = output.tell()
-            original_size = len(img_data)
-            self.logger.info(f"Compressed image from {original_size/1024:.1f}KB to {compressed_size/1024:.1f}KB (quality={quality})")
-            
-            return output.getvalue()
+            compressed, quality, encodes = compress_image_data(
+                img_data, self.max_image_size_kb, self.compression_quality
+            )
+            if quality is not None:
+                self._record_encodes(encodes)
+                self._log_compression(img_data, compressed, 'image/jpeg', quality, encodes)
+            return compressed
             
         except Exception as e:
             self.logger.error(f"Error compressing image: {str(e)}")
             return img_data
-    def _process_url(self, url, progress_callback=None):
+    def _process_url(self, url, progress_callback=None, depth=0):
         """Process a single URL"""
-        if url in self.visited_urls or not url.startswith(self.base_url):
+        url = self.canonicalize(url)
+        # Atomic check-and-add: only one worker ever processes a URL
+        if not url.startswith(self.base_url) or not self.visited_urls.add(url):
             return
 
         try:
-            self.visited_urls.add(url)
-            
-            if self.wait_for_ajax:
-                # Get content with dynamic AJAX handling
-                html_content = self.capture_ajax_content(url)
-                if html_content:
-                    modified_html = self._process_html(url, html_content)
-                    self._save_html_page(url, modified_html)
-                else:
-                    # Fallback to regular request
-                    response = requests.get(url, timeout=30)
-                    response.raise_for_status()
-                    self._handle_response(url, response)
-            else:
-                # Regular request without AJAX handling
-                response = requests.get(url, timeout=30)
+            response = None
+            chunks = None
+            render = self.wait_for_ajax
+            if render and self.classifier and not self.classifier.remembered(url):
+                # Plain HTTP first; only pages that need JavaScript are
+                # rendered. The body streams like any other page fetch.
+                response = self.fetch(url, stream=self.warc_writer is None)
                 response.raise_for_status()
-                self._handle_response(url, response)
+                render, chunks = self._classify(url, response)
+            
+            rendered = False
+            if render:
+                # Get content with dynamic AJAX handling, reusing the
+                # resources the browser already downloaded
+                browser_responses = {}
+                ajax_data = {}
+                html_content = self.capture_ajax_content(url, browser_responses, ajax_data)
+                if html_content and self._exceeds_stream_threshold(html_content):
+                    self._stream_html_page(url, iter_chunks(html_content), depth, ajax_data)
+                    rendered = True
+                elif html_content:
+                    modified_html = self._process_html(url, html_content, browser_responses, depth)
+                    self._save_html_page(url, modified_html, ajax_data)
+                    rendered = True
+                if rendered and response is not None:
+                    # Rest of the classified body is not needed
+                    response.close()
+            
+            if not rendered:
+                if response is None:
+                    # Regular request, or fallback when rendering failed;
+                    # the body is read as needed so huge pages can stream,
+                    # unless it is recorded to a WARC whole
+                    response = self.fetch(url, stream=self.warc_writer is None)
+                    response.raise_for_status()
+                self._handle_response(url, response, depth, chunks)
 
+            if self.journal:
+                self.journal.record_done(url)
+            
             if progress_callback:
                 progress_callback(len(self.visited_urls), url)
                 
         except Exception as e:
             self.logger.error(f"Error processing {url}: {str(e)}")
+            if self.journal:
+                self.journal.record_failed(url, e)
 
-    def _handle_response(self, url, response):
-        """Handle different types of responses"""
-        content_type = response.headers.get('content-type', '').split(';')[0]
-        
-        if 'text/html' in content_type:
-            modified_html = self._process_html(url, response.text)
-            self._save_html_page(url, modified_html)
+    def _classify(self, url, response):
+        """Classify a plainly fetched page from the start of its body
+
+        Returns whether the page needs a browser, and for HTML the decoded
+        chunks of the whole body with the inspected prefix put back, so the
+        rest of the page is only read and decoded once.
+        """
+        if not self._is_html(response):
+            return self._needs_browser(url, None), None
+        chunks = self._html_chunks(response)
+        prefix = []
+        size = 0
+        for chunk in chunks:
+            prefix.append(chunk)
+            size += len(chunk)
+            if size >= self.classifier.PREFIX_CHARS:
+                break
+        return self._needs_browser(url, ''.join(prefix)), itertools.chain(prefix, chunks)
+
+    def _needs_browser(self, url, html):
+        """Classify a page's markup (None if not HTML), counting those that skip the browser"""
+        if html is not None and self.classifier.needs_browser(url, html[:self.classifier.PREFIX_CHARS]):
+            return True
+        with self._render_stats_lock:
+            self.static_pages += 1
+        return False
+
+    @staticmethod
+    def _is_html(response):
+        """Check if a response carries an HTML page"""
+        return 'text/html' in response.headers.get('content-type', '').split(';')[0]
+
+    def _handle_response(self, url, response, depth=0, chunks=None):
+        """Handle different types of responses
+
+        ``chunks`` are the decoded chunks of an HTML body already being read.
+        """
+        if self._is_html(response):
+            html_content = self._read_html(response, chunks)
+            if isinstance(html_content, str):
+                modified_html = self._process_html(url, html_content, depth=depth)
+                self._save_html_page(url, modified_html)
+            else:
+                self._stream_html_page(url, html_content, depth)
         else:
             self._save_asset(url, response.content)
 
-    def _process_html(self, base_url, html_content):
-        """Process HTML content and embedded resources"""
+    def _exceeds_stream_threshold(self, html_content):
+        """Check if markup is large enough to be rewritten as a stream"""
+        return self.stream_threshold is not None and len(html_content) > self.stream_threshold
+
+    def _html_chunks(self, response):
+        """Decode a page's body into text chunks, read from the network as they are consumed"""
+        if getattr(response, '_content_consumed', True):
+            return iter_chunks(response.text)
+        if response.encoding is None:
+            response.encoding = 'utf-8'
+        return response.iter_content(STREAM_CHUNK_SIZE, decode_unicode=True)
+
+    def _read_html(self, response, chunks=None):
+        """Return a page's markup, or an iterator of chunks once it exceeds the stream threshold"""
+        if chunks is None:
+            if getattr(response, '_content_consumed', True):
+                # Body already in memory: streaming still avoids the tree
+                text = response.text
+                return iter_chunks(text) if self._exceeds_stream_threshold(text) else text
+            chunks = self._html_chunks(response)
+        
+        buffered = []
+        size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if self.stream_threshold is not None and size > self.stream_threshold:
+                return itertools.chain(buffered, chunks)
+        return ''.join(buffered)
+    def _collect_resource_urls(self, base_url, page):
+        """Collect the absolute URLs of every resource a page rewrite downloads"""
+        urls = []
+        targets = [(img.get('src'), 'image', self._display_size(img)) for img in page.images]
+        targets += [(link.get('href'), 'css', ()) for link in page.stylesheets]
+        targets += [(script.get('src'), 'script', ()) for script in page.scripts]
+        targets += [(link.get('href'), 'link', ()) for link in page.icons]
+        targets += [
+            (match.group(1), 'css-url', ())
+            for tag in page.styles for match in CSS_URL_PATTERN.finditer(tag['style'])
+        ]
+        
+        for value, kind, variant in targets:
+            if not value:
+                continue
+            absolute_url = self._resolve(base_url, value)
+            if not absolute_url.startswith(self.base_url) or absolute_url in urls:
+                continue
+            # Already processed on an earlier page
+            if (kind, absolute_url, *variant) in self.asset_cache or self._is_recorded(absolute_url):
+                continue
+            urls.append(absolute_url)
+        return urls
+
+    def _collect_css_urls(self, base_url, css_content):
+        """Collect the absolute URLs referenced by url() in CSS content"""
+        urls = []
+        for match in CSS_URL_PATTERN.finditer(css_content):
+            absolute_url = self._resolve(base_url, match.group(1))
+            if not absolute_url.startswith(self.base_url) or absolute_url in urls:
+                continue
+            if ('css-url', absolute_url) in self.asset_cache or self._is_recorded(absolute_url):
+                continue
+            urls.append(absolute_url)
+        return urls
+
+    def _collect_stylesheet_urls(self, responses):
+        """Collect url() references of downloaded stylesheets not yet in responses"""
+        urls = []
+        for url, response in responses.items():
+            if isinstance(response, Exception) or not response.ok:
+                continue
+            if 'css' in response.headers.get('content-type', '') or url.endswith('.css'):
+                # url() references resolve against the stylesheet itself
+                urls += [u for u in self._collect_css_urls(url, response.text)
+                         if u not in responses and u not in urls]
+        return urls
+
+    def _log_compression(self, source, data, content_type, quality, encodes):
+        """Log one image's recompression with the quality and encodes it took"""
+        self.logger.info(
+            f"Compressed image from {len(source)/1024:.1f}KB to {len(data)/1024:.1f}KB "
+            f"as {content_type} (quality={quality}, {encodes} encodes)"
+        )
+
+    def _record_encodes(self, encodes):
+        """Count the encodes an image recompression needed"""
+        with self._image_stats_lock:
+            self.images_compressed += 1
+            self.image_encodes += encodes
+
+    def _fetch_or_error(self, url):
+        """Fetch a URL, returning the exception instead of raising it"""
+        try:
+            return self.fetch(url)
+        except Exception as e:
+            return e
+
+    def _prefetch_resources(self, base_url, page, known=None):
+        """Download every resource of a page not in ``known`` concurrently before the rewrite"""
+        pool = self._get_asset_pool()
+        responses = dict(known or {})
+        urls = [u for u in self._collect_resource_urls(base_url, page) if u not in responses]
+        responses.update(zip(urls, pool.map(self._fetch_or_error, urls)))
+        
+        # Stylesheets reference further assets through url()
+        css_urls = self._collect_stylesheet_urls(responses)
+        responses.update(zip(css_urls, pool.map(self._fetch_or_error, css_urls)))
+        return responses
+
+    def _process_html(self, base_url, html_content, responses=None, depth=0):
+        """Process HTML content and embedded resources
+
+        ``html_content`` may be markup or an already ParsedPage. ``responses``
+        maps absolute resource URLs to responses (or the exception raised while
+        fetching them) downloaded ahead of the rewrite; they are served by
+        fetch() instead of hitting the network again. With more than one
+        asset worker, any other resources are downloaded concurrently first so
+        a page costs roughly its slowest asset rather than the sum.
+        In-scope links are queued at ``depth + 1`` and rewritten to the
+        local copies.
+        """
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
+            if isinstance(html_content, ParsedPage):
+                page = html_content
+            else:
+                page = self._parse_page(html_content)
             
-            # Process images
-            for img in soup.find_all('img'):
-                self._process_image_tag(base_url, img)
+            if self.asset_workers > 1:
+                responses = self._prefetch_resources(base_url, page, responses)
+            self._page_local.responses = responses
             
-            # Process CSS
-            for link in soup.find_all('link', rel='stylesheet'):
-                self._process_css_tag(base_url, link)
+            self._rewrite_targets(base_url, page, depth)
+            return str(page)
             
-            # Process JavaScript
-            for script in soup.find_all('script', src=True):
-                self._process_script_tag(base_url, script)
+        except Exception as e:
+            self.logger.error(f"Error processing HTML from {base_url}: {str(e)}")
+            return str(html_content)
+        
+        finally:
+            self._page_local.responses = None
+
+    def _rewrite_targets(self, base_url, page, depth=0):
+        """Embed the resources of a parsed page and rewrite its links"""
+        # Process images
+        for img in page.images:
+            self._process_image_tag(base_url, img)
+        
+        # Process CSS
+        for link in page.stylesheets:
+            self._process_css_tag(base_url, link)
+        
+        # Process inline style attributes
+        for tag in page.styles:
+            self._process_style_attribute(base_url, tag)
+        
+        # Process JavaScript
+        for script in page.scripts:
+            self._process_script_tag(base_url, script)
+        
+        # Process other resources
+        for link in page.icons:
+            self._process_link_tag(base_url, link)
+        
+        # Discover links to further pages
+        for anchor in page.anchors:
+            self._process_anchor_tag(base_url, anchor, depth)
+
+    def _stream_html_page(self, url, chunks, depth=0, ajax_data=None):
+        """Rewrite a large page chunk by chunk straight into its output file"""
+        try:
+            full_path = os.path.join(self.output_dir, self._url_to_filepath(url))
+            
+            if self.warc_writer is not None:
+                # Rewritten only to discover links and fetch assets
+                output = open(os.devnull, 'w', encoding='utf-8')
+            elif self.gzip_html:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                output = gzip.open(f"{full_path}.gz", 'wt', encoding='utf-8')
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                output = open(full_path, 'w', encoding='utf-8')
+            with output:
+                rewriter = StreamingRewriter(
+                    output.write,
+                    partial(self._rewrite_streamed_tag, url, depth),
+                    head_end=self._ajax_script(ajax_data)
+                )
+                for chunk in chunks:
+                    rewriter.feed(chunk)
+                rewriter.close()
+            
+            self.logger.info(f"Saved HTML page (streamed): {url}")
+            
+        except Exception as e:
+            self.logger.error(f"Error streaming HTML page {url}: {str(e)}")
+
+    def _rewrite_streamed_tag(self, base_url, depth, name, attrs, raw):
+        """Rewrite one start tag of a streamed page with the regular tag processors"""
+        names = {attr for attr, _ in attrs}
+        if not (name in ('img', 'link', 'a') or (name == 'script' and 'src' in names)
+                or 'style' in names or 'srcset' in names):
+            return None
+        
+        if name == 'source' and 'srcset' in names:
+            # A <picture> variant; the <img> inside picks its own candidate
+            return '', False
+        
+        # The tag alone is a tiny document; html.parser adds no html/body wrapper
+        fragment = ParsedPage.parse(raw, 'html.parser')
+        for img in fragment.images:
+            self._resolve_responsive_image(img)
+        self._rewrite_targets(base_url, fragment, depth)
+        element = fragment.soup.find(True)
+        if element is None:
+            return None
+        if element.name != name:
+            # Replaced outright, e.g. a stylesheet link inlined as <style>
+            return str(element), False
+        if name == 'script' and not element.has_attr('src'):
+            return format_start_tag(element) + (element.string or ''), True
+        return format_start_tag(element), False
+
+    def _parse_page(self, html_content):
+        """Parse markup with the configured parser and collect its rewrite targets
+
+        Responsive and lazy images are narrowed to a single src first, so
+        prefetching and the rewrite only ever see the chosen candidate.
+        """
+        page = ParsedPage.parse(html_content, self.html_parser)
+        for img in page.images:
+            self._resolve_responsive_image(img)
+        return page
+
+    def _resolve_responsive_image(self, img):
+        """Point an image's src at its one appropriately sized candidate
+
+        Lazy-load attributes take precedence over a placeholder src, a
+        matching <picture><source> over the image's own srcset, and the
+        candidate is chosen for the rendered width. The other variants,
+        including the <picture> sources, are dropped.
+        """
+        # With lazy loading, src only holds a placeholder
+        src = next((img[a] for a in LAZY_SRC_ATTRIBUTES if img.get(a)), None) or img.get('src')
+        srcset = next((img[a] for a in LAZY_SRCSET_ATTRIBUTES + ('srcset',) if img.get(a)), None)
+        
+        # Parsers that do not know <source> is void nest the <img> inside it
+        picture = img.find_parent('picture')
+        if picture is not None:
+            sources = picture.find_all('source')
+            for source in sources:
+                candidates = source.get('data-srcset') or source.get('srcset')
+                source_type = (source.get('type') or '').split(';')[0].strip().lower()
+                if source_type and source_type not in SUPPORTED_SOURCE_TYPES:
+                    continue
+                if source.get('media') and not _media_matches(source['media']):
+                    continue
+                if candidates:
+                    srcset = candidates
+                    if source.get('sizes') and not img.get('sizes'):
+                        img['sizes'] = source['sizes']
+                    break
+            for source in sources:
+                source.unwrap()
+        
+        if srcset:
+            chosen = self._choose_srcset_candidate(parse_srcset(srcset), self._display_size(img)[0])
+            if chosen and _is_fetchable_reference(chosen):
+                src = chosen
+        if src:
+            img['src'] = src
+        for attr in LAZY_SRC_ATTRIBUTES + LAZY_SRCSET_ATTRIBUTES + ('srcset',):
+            if attr in img.attrs:
+                del img[attr]
+
+    def _choose_srcset_candidate(self, candidates, display_width=None):
+        """Pick the smallest candidate covering the rendered size, else the largest"""
+        widths = [(width, url) for url, width, _ in candidates if width]
+        if widths:
+            # Without sizes, an image is laid out at the full viewport width
+            target = display_width or VIEWPORT_WIDTH * self.image_dpr
+            fitting = [c for c in widths if c[0] >= target]
+            return (min(fitting) if fitting else max(widths))[1]
+        densities = [(density, url) for url, _, density in candidates if density]
+        if densities:
+            fitting = [c for c in densities if c[0] >= self.image_dpr]
+            return (min(fitting) if fitting else max(densities))[1]
+        return None
+
+    def _process_anchor_tag(self, base_url, anchor, depth):
+        """Queue a linked page and point the link at its archived copy"""
+        try:
+            href = anchor['href']
+            absolute_url = self._normalize_link(base_url, href)
+            if not absolute_url:
+                return
             
-            # Process other resources
-            for link in soup.find_all('link', rel=['icon', 'shortcut icon']):
-                self._process_link_tag(base_url, link)
+            if not self._should_crawl(absolute_url) or (
+                    absolute_url != base_url and not self._enqueue(absolute_url, depth + 1)):
+                # Not archived (other site, excluded file type or outside the
+                # crawl limits): keep pointing at the live site
+                anchor['href'] = urljoin(base_url, href)
+                return
             
-            return str(soup)
+            relative_path = posixpath.relpath(self._url_to_filepath(absolute_url), self._page_dir(base_url) or '.')
+            fragment = urldefrag(href)[1]
+            anchor['href'] = f"{relative_path}#{fragment}" if fragment else relative_path
             
         except Exception as e:
-            self.logger.error(f"Error processing HTML from {base_url}: {str(e)}")
-            return html_content
+            self.logger.error(f"Error processing link {anchor.get('href')}: {str(e)}")
 
     def _process_image_tag(self, base_url, img):
         """Process and embed an image tag"""
@@ -359,37 +1130,102 @@ class WebsiteArchiver:
             if not src:
                 return
                 
-            absolute_url = urljoin(base_url, src)
+            absolute_url = self._resolve(base_url, src)
             
             if not absolute_url.startswith(self.base_url):
                 return
-                
-            response = requests.get(absolute_url, timeout=30)
-            response.raise_for_status()
-            
-            content_type = response.headers.get('content-type', '')
-            if not content_type:
-                content_type, _ = mimetypes.guess_type(absolute_url)
             
-            if not content_type:
-                content_type = 'image/jpeg'
-            
-            # Compress image if enabled
-            if self.compress_images:
-                img_data = self.compress_image(response.content)
-            else:
-                img_data = response.content
+            if self.warc_writer is not None:
+                # Only the raw exchange is kept; the tag stays as it is
+                self._record_asset(absolute_url, 'image')
+                return
             
-            # Encode as base64
-            encoded = base64.b64encode(img_data).decode('utf-8')
-            data_url = f"data:{content_type};base64,{encoded}"
+            max_width, max_height = self._display_size(img)
+            cache_key = ('image', absolute_url, max_width, max_height)
+            data_url = self.asset_cache.get(cache_key)
+            if data_url is None:
+                response = self.fetch(absolute_url)
+                response.raise_for_status()
+                
+                content_type = response.headers.get('content-type', '')
+                if not content_type:
+                    content_type, _ = mimetypes.guess_type(absolute_url)
+                
+                if not content_type:
+                    content_type = 'image/jpeg'
+                
+                data, content_type = self._transcode_image(response.content, content_type, max_width, max_height)
+                data_url = self._embed(data, content_type, absolute_url)
+                self.asset_cache.put(cache_key, data_url)
             
-            img['src'] = data_url
+            img['src'] = relative_reference(data_url, self._page_dir(base_url))
             self.logger.info(f"Processed image: {absolute_url}")
             
         except Exception as e:
             self.logger.error(f"Error processing image {src}: {str(e)}")
 
+    def _transcode_image(self, source, content_type, max_width=None, max_height=None):
+        """Downscale and re-encode downloaded image bytes, returning (data, content type)
+
+        Output of earlier runs is reused from the persistent image cache.
+        """
+        settings = (
+            content_type, self.compress_images, self.max_image_size_kb, self.compression_quality,
+            max_width, max_height, self.image_formats
+        )
+        image_cache = self._get_image_cache()
+        if image_cache is not None:
+            key = ImageCache.make_key(source, *settings)
+            cached = image_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        # Downscale, recompress and encode, in a worker process if configured
+        data, output_type, quality, encodes, error = self._run_cpu(transcode_image, source, *settings)
+        if error:
+            self.logger.error(error)
+        elif encodes:
+            self._record_encodes(encodes)
+            if quality is not None:
+                self._log_compression(source, data, output_type, quality, encodes)
+            if image_cache is not None:
+                image_cache.put(key, data, output_type)
+        return data, output_type
+
+    def _display_size(self, img):
+        """Largest size an image tag is rendered at in device pixels, from its attributes and CSS
+
+        Either dimension is None when unknown or when downscaling is off.
+        """
+        if not self.downscale_images:
+            return None, None
+        
+        width = _css_pixels(img.get('width'))
+        height = _css_pixels(img.get('height'))
+        declarations = dict(
+            (name.strip().lower(), value.strip())
+            for name, _, value in (d.partition(':') for d in (img.get('style') or '').split(';'))
+        )
+        for name in ('width', 'max-width'):
+            if _css_pixels(declarations.get(name)):
+                width = _css_pixels(declarations[name])
+        for name in ('height', 'max-height'):
+            if _css_pixels(declarations.get(name)):
+                height = _css_pixels(declarations[name])
+        
+        # With sizes, the widest slot bounds the rendered width; any
+        # relative slot (vw, calc...) makes it unknown
+        if img.get('sizes'):
+            slots = [_css_pixels(entry.split()[-1]) for entry in img['sizes'].split(',') if entry.strip()]
+            width = max(slots) if slots and all(slots) else None
+            height = None
+        
+        scale = self.image_dpr
+        return (
+            math.ceil(width * scale) if width else None,
+            math.ceil(height * scale) if height else None
+        )
+
     def _process_css_tag(self, base_url, link):
         """Process and embed a CSS stylesheet"""
         try:
@@ -397,18 +1233,34 @@ class WebsiteArchiver:
             if not href:
                 return
                 
-            absolute_url = urljoin(base_url, href)
+            absolute_url = self._resolve(base_url, href)
             
             if not absolute_url.startswith(self.base_url):
                 return
-                
-            # Download CSS
-            response = requests.get(absolute_url, timeout=30)
-            response.raise_for_status()
             
-            # Process CSS content to handle url() references
-            css_content = response.text
-            css_content = self._process_css_urls(base_url, css_content)
+            if self.warc_writer is not None:
+                # Only the raw exchange is kept; the tag stays as it is
+                self._record_asset(absolute_url, 'css')
+                return
+            
+            css_content = self.asset_cache.get(('css', absolute_url))
+            if css_content is None:
+                # Download CSS
+                response = self.fetch(absolute_url)
+                response.raise_for_status()
+                
+                # Process CSS content to handle url() references, which
+                # resolve against the stylesheet rather than the page
+                css_content = self._process_css_urls(absolute_url, response.text, ASSET_DIR)
+                if self.asset_store is not None:
+                    css_content = self.asset_store.store(css_content.encode('utf-8'), 'text/css', absolute_url)
+                self.asset_cache.put(('css', absolute_url), css_content)
+            
+            if self.asset_store is not None:
+                # css_content is the stored stylesheet's path
+                link['href'] = relative_reference(css_content, self._page_dir(base_url))
+                self.logger.info(f"Processed CSS: {absolute_url}")
+                return
             
             # Create style tag
             style_tag = BeautifulSoup('', 'html.parser').new_tag('style')
@@ -422,20 +1274,30 @@ class WebsiteArchiver:
         except Exception as e:
             self.logger.error(f"Error processing CSS {href}: {str(e)}")
 
-    def _process_css_urls(self, base_url, css_content):
-        """Process URLs within CSS content"""
+    def _process_css_urls(self, base_url, css_content, document_dir=None):
+        """Process URLs within CSS content
+
+        External assets are referenced relative to ``document_dir``, the
+        directory of the file the CSS ends up in.
+        """
         try:
-            url_pattern = re.compile(r'url\([\'"]?([^\'"()]+)[\'"]?\)')
-            
             def replace_url(match):
                 url = match.group(1)
-                absolute_url = urljoin(base_url, url)
+                absolute_url = self._resolve(base_url, url)
                 
                 if not absolute_url.startswith(self.base_url):
                     return f'url("{url}")'
                 
+                if self.warc_writer is not None:
+                    self._record_asset(absolute_url, 'css-url')
+                    return match.group(0)
+                
+                data_url = self.asset_cache.get(('css-url', absolute_url))
+                if data_url is not None:
+                    return f'url("{relative_reference(data_url, document_dir)}")'
+                
                 try:
-                    response = requests.get(absolute_url, timeout=30)
+                    response = self.fetch(absolute_url)
                     response.raise_for_status()
                     
                     content_type = response.headers.get('content-type', '')
@@ -445,20 +1307,26 @@ class WebsiteArchiver:
                     if not content_type:
                         return f'url("{url}")'
                     
-                    encoded = base64.b64encode(response.content).decode('utf-8')
-                    data_url = f"data:{content_type};base64,{encoded}"
+                    data_url = self._embed(response.content, content_type, absolute_url)
+                    self.asset_cache.put(('css-url', absolute_url), data_url)
                     
-                    return f'url("{data_url}")'
+                    return f'url("{relative_reference(data_url, document_dir)}")'
                     
                 except Exception:
                     return f'url("{url}")'
             
-            return url_pattern.sub(replace_url, css_content)
+            return CSS_URL_PATTERN.sub(replace_url, css_content)
             
         except Exception as e:
             self.logger.error(f"Error processing CSS URLs: {str(e)}")
             return css_content
 
+    def _process_style_attribute(self, base_url, tag):
+        """Embed the url() references of an inline style attribute"""
+        style = tag.get('style')
+        if style and CSS_URL_PATTERN.search(style):
+            tag['style'] = self._process_css_urls(base_url, style, self._page_dir(base_url))
+
     def _process_script_tag(self, base_url, script):
         """Process and embed a JavaScript file"""
         try:
@@ -466,17 +1334,36 @@ class WebsiteArchiver:
             if not src:
                 return
                 
-            absolute_url = urljoin(base_url, src)
+            absolute_url = self._resolve(base_url, src)
             
             if not absolute_url.startswith(self.base_url):
                 return
+            
+            if self.warc_writer is not None:
+                # Only the raw exchange is kept; the tag stays as it is
+                self._record_asset(absolute_url, 'script')
+                return
                 
-            # Download JavaScript
-            response = requests.get(absolute_url, timeout=30)
-            response.raise_for_status()
+            script_content = self.asset_cache.get(('script', absolute_url))
+            if script_content is None:
+                # Download JavaScript
+                response = self.fetch(absolute_url)
+                response.raise_for_status()
+                if self.asset_store is not None:
+                    content_type = response.headers.get('content-type') or 'application/javascript'
+                    script_content = self.asset_store.store(response.content, content_type, absolute_url)
+                else:
+                    script_content = response.text
+                self.asset_cache.put(('script', absolute_url), script_content)
+            
+            if self.asset_store is not None:
+                # script_content is the stored script's path
+                script['src'] = relative_reference(script_content, self._page_dir(base_url))
+                self.logger.info(f"Processed JavaScript: {absolute_url}")
+                return
             
             # Update script content
-            script.string = response.text
+            script.string = script_content
             del script['src']
             
             self.logger.info(f"Processed JavaScript: {absolute_url}")
@@ -491,42 +1378,70 @@ class WebsiteArchiver:
             if not href:
                 return
                 
-            absolute_url = urljoin(base_url, href)
+            absolute_url = self._resolve(base_url, href)
             
             if not absolute_url.startswith(self.base_url):
                 return
-                
-            # Download resource
-            response = requests.get(absolute_url, timeout=30)
-            response.raise_for_status()
-            
-            content_type = response.headers.get('content-type', '')
-            if not content_type:
-                content_type, _ = mimetypes.guess_type(absolute_url)
             
-            if not content_type:
+            if self.warc_writer is not None:
+                # Only the raw exchange is kept; the tag stays as it is
+                self._record_asset(absolute_url, 'link')
                 return
+                
+            data_url = self.asset_cache.get(('link', absolute_url))
+            if data_url is None:
+                # Download resource
+                response = self.fetch(absolute_url)
+                response.raise_for_status()
+                
+                content_type = response.headers.get('content-type', '')
+                if not content_type:
+                    content_type, _ = mimetypes.guess_type(absolute_url)
+                
+                if not content_type:
+                    return
+                
+                data_url = self._embed(response.content, content_type, absolute_url)
+                self.asset_cache.put(('link', absolute_url), data_url)
             
-            # Encode as base64
-            encoded = base64.b64encode(response.content).decode('utf-8')
-            data_url = f"data:{content_type};base64,{encoded}"
-            
-            link['href'] = data_url
+            link['href'] = relative_reference(data_url, self._page_dir(base_url))
             self.logger.info(f"Processed link resource: {absolute_url}")
             
         except Exception as e:
             self.logger.error(f"Error processing link {href}: {str(e)}")
 
-    def _save_html_page(self, url, content):
-        """Save processed HTML page"""
-        try:
-            # Insert AJAX data if available
-            if self.ajax_data:
-                ajax_script = f"""
+    def _embed(self, data, content_type, url=None):
+        """Store an asset body: a data URL when inlining, else a file under assets/"""
+        if self.asset_store is None:
+            return to_data_url(data, content_type)
+        return self.asset_store.store(data, content_type, url)
+
+    def _page_dir(self, url):
+        """Directory of a page's archived file, relative to the archive root"""
+        return posixpath.dirname(self._url_to_filepath(url))
+
+    @staticmethod
+    def _ajax_script(ajax_data):
+        """Script defining window.ajaxData for a page, or None without AJAX data"""
+        if not ajax_data:
+            return None
+        # Escaped so a payload cannot close the script
+        payload = json.dumps(ajax_data).replace('</', '<\\/')
+        return f"""
                 <script>
-                    window.ajaxData = {json.dumps(self.ajax_data)};
+                    window.ajaxData = {payload};
                 </script>
                 """
+
+    def _save_html_page(self, url, content, ajax_data=None):
+        """Save processed HTML page with the AJAX responses it made"""
+        if self.warc_writer is not None:
+            # Recorded as fetched; WARC output keeps no rewritten copies
+            return
+        try:
+            # Only this page's own AJAX data
+            ajax_script = self._ajax_script(ajax_data)
+            if ajax_script:
                 content = content.replace('</head>', f'{ajax_script}</head>')
             
             relative_path = self._url_to_filepath(url)
@@ -535,8 +1450,9 @@ class WebsiteArchiver:
             os.makedirs(os.path.dirname(full_path), exist_ok=True)
             
             # Compress HTML if it's large
-            if len(content.encode('utf-8')) > 1024 * 100:  # Compress if > 100KB
-                compressed = gzip.compress(content.encode('utf-8'))
+            encoded = content.encode('utf-8')
+            if self.gzip_html and len(encoded) > 1024 * 100:  # Compress if > 100KB
+                compressed = self._run_cpu(gzip.compress, encoded)
                 with open(f"{full_path}.gz", 'wb') as f:
                     f.write(compressed)
             else:
@@ -550,6 +1466,8 @@ class WebsiteArchiver:
 
     def _save_asset(self, url, content):
         """Save a non-HTML asset"""
+        if self.warc_writer is not None:
+            return
         try:
             relative_path = self._url_to_filepath(url)
             full_path = os.path.join(self.output_dir, relative_path)
@@ -573,14 +1491,23 @@ class WebsiteArchiver:
             path = 'index.html'
         elif not os.path.splitext(path)[1]:
             path = os.path.join(path, 'index.html')
+        
+        if parsed.query:
+            # One file per query, e.g. paginated listings
+            root, extension = os.path.splitext(path)
+            digest = hashlib.sha1(parsed.query.encode('utf-8')).hexdigest()[:10]
+            path = f"{root}-{digest}{extension}"
             
         return path
 
     def _should_download(self, url):
         """Check if URL should be downloaded"""
+        return self._is_archivable(url) and url not in self.visited_urls
+
+    def _is_archivable(self, url):
+        """Check a URL's host and file type, regardless of crawl state"""
         parsed = urlparse(url)
         return (
             parsed.netloc == self.domain and
-            url not in self.visited_urls and
             not any(ext in url for ext in ['.pdf', '.zip', '.exe'])
         )
\ No newline at end of file
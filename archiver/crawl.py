@@ -0,0 +1,266 @@
+# archiver/crawl.py
+import fnmatch
+import hashlib
+import math
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+
+class VisitedSet:
+    """Thread-safe set of URLs with an atomic check-and-add"""
+
+    def __init__(self):
+        self._urls = set()
+        self._lock = threading.Lock()
+
+    def add(self, url):
+        """Add a URL, returning True only for the caller that added it first"""
+        with self._lock:
+            if url in self._urls:
+                return False
+            self._urls.add(url)
+            return True
+
+    def __contains__(self, url):
+        return url in self._urls
+
+    def __len__(self):
+        return len(self._urls)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._urls))
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+class BloomVisitedSet:
+    """Memory-bounded visited set backed by a Bloom filter
+
+    Memory is fixed up front from the expected number of URLs and the
+    acceptable false positive rate (10 million URLs at 0.1% take about
+    18 MB). A false positive makes a URL look visited, so it is skipped;
+    URLs are never processed twice. URLs are not stored, so the set cannot
+    be iterated.
+    """
+
+    def __init__(self, capacity=10_000_000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, url):
+        """Bit positions for a URL using double hashing of one digest"""
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, url):
+        """Add a URL, returning True only if it was not (probably) present"""
+        positions = self._positions(url)
+        with self._lock:
+            present = all(self._bits[p >> 3] & (1 << (p & 7)) for p in positions)
+            if present:
+                return False
+            for p in positions:
+                self._bits[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+            return True
+
+    def __contains__(self, url):
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(url))
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self._count = 0
+
+
+def create_visited_set(mode='exact', capacity=10_000_000, error_rate=0.001):
+    """Create a visited set for the given mode ('exact' or 'bloom')"""
+    if mode == 'bloom':
+        return BloomVisitedSet(capacity, error_rate)
+    if mode == 'exact':
+        return VisitedSet()
+    raise ValueError(f"Unknown visited set mode: {mode}")
+
+
+class CrawlJournal:
+    """Persistent crawl state in a SQLite database inside the output directory
+
+    Records every URL entering the frontier with its depth and status
+    ('queued', 'done' or 'failed') so an interrupted archive can resume.
+    Writes are committed in batches; after a hard kill at most the last
+    batch of status changes is lost and those pages are fetched again.
+    """
+
+    QUEUED = 'queued'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path, commit_every=100, commit_interval=2.0):
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                depth INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                updated REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _write(self, sql, params):
+        """Execute a statement and commit once enough changes have piled up"""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(sql, params)
+            self._pending += 1
+            now = time.monotonic()
+            if self._pending >= self.commit_every or now - self._last_commit >= self.commit_interval:
+                self._conn.commit()
+                self._pending = 0
+                self._last_commit = now
+
+    def record_queued(self, url, depth):
+        """Record a URL entering the frontier"""
+        self._write(
+            "INSERT OR IGNORE INTO urls (url, depth, status, updated) VALUES (?, ?, ?, ?)",
+            (url, depth, self.QUEUED, time.time())
+        )
+
+    def record_done(self, url):
+        """Record a URL as archived"""
+        self._write(
+            "UPDATE urls SET status = ?, error = NULL, updated = ? WHERE url = ?",
+            (self.DONE, time.time(), url)
+        )
+
+    def record_failed(self, url, error):
+        """Record a URL whose processing failed"""
+        self._write(
+            "UPDATE urls SET status = ?, error = ?, updated = ? WHERE url = ?",
+            (self.FAILED, str(error), time.time(), url)
+        )
+
+    def entries(self):
+        """Yield (url, depth, status) for every recorded URL"""
+        with self._lock:
+            self._conn.commit()
+            rows = self._conn.execute("SELECT url, depth, status FROM urls ORDER BY rowid").fetchall()
+        yield from rows
+
+    def status(self, url):
+        """Return the recorded status of a URL, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM urls WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def reset(self):
+        """Forget all recorded state"""
+        with self._lock:
+            self._conn.execute("DELETE FROM urls")
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        """Commit outstanding changes and close the database"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+
+class URLCanonicalizer:
+    """Reduce equivalent URLs to one canonical form
+
+    Lowercases scheme and host, drops default ports and fragments, removes
+    tracking query parameters matching glob patterns and sorts the rest by
+    name. Stripping trailing slashes is off by default because a page at
+    ``docs/`` resolves relative links differently from one at ``docs``.
+    """
+
+    DEFAULT_DROP_PARAMS = (
+        'utm_*', 'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid',
+        'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi',
+    )
+    DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+    def __init__(self, drop_params=DEFAULT_DROP_PARAMS, sort_query=True,
+                 strip_trailing_slash=False):
+        self.drop_params = tuple(drop_params or ())
+        self.sort_query = sort_query
+        self.strip_trailing_slash = strip_trailing_slash
+        self._drop_pattern = None
+        if self.drop_params:
+            self._drop_pattern = re.compile(
+                '|'.join(fnmatch.translate(p) for p in self.drop_params), re.IGNORECASE
+            )
+
+    def __call__(self, url):
+        return self.canonicalize(url)
+
+    @staticmethod
+    def _param_name(segment):
+        """Decoded name of a raw ``name=value`` query segment"""
+        return unquote_plus(segment.split('=', 1)[0])
+
+    def canonicalize(self, url):
+        """Return the canonical form of an absolute URL"""
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return url
+
+        scheme = parts.scheme.lower()
+        host = parts.hostname or ''
+        if ':' in host:
+            host = f"[{host}]"
+        if port is not None and port != self.DEFAULT_PORTS.get(scheme):
+            host = f"{host}:{port}"
+        if parts.username is not None:
+            userinfo = parts.netloc.rsplit('@', 1)[0]
+            host = f"{userinfo}@{host}"
+
+        path = parts.path or '/'
+        if self.strip_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+
+        query = parts.query
+        if query and (self._drop_pattern or self.sort_query):
+            # Raw segments are kept as sent; only their order and the dropped
+            # parameters change, so the server sees the same request
+            params = [(self._param_name(segment), segment) for segment in query.split('&')]
+            if self._drop_pattern:
+                params = [(name, segment) for name, segment in params if not self._drop_pattern.match(name)]
+            if self.sort_query:
+                # Stable sort keeps the order of repeated parameters
+                params.sort(key=lambda item: item[0])
+            query = '&'.join(segment for _, segment in params)
+
+        return urlunsplit((scheme, host, path, query, ''))
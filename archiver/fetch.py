@@ -0,0 +1,253 @@
+# archiver/fetch.py
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+def build_response(url, status_code, headers, content, encoding=None):
+    """Wrap a body downloaded outside of requests in a requests.Response"""
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers or {})
+    response._content = content
+    response._content_consumed = True
+    response.encoding = encoding
+    return response
+
+
+class Fetcher:
+    """Pooled, keep-alive HTTP client shared by every fetch of an archiver
+
+    Page workers and asset threads share one requests.Session, so its
+    thread-safe urllib3 pools hold up to ``pool_maxsize`` persistent
+    connections per host and any thread reuses a connection another one
+    left idle.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False,
+                 max_retries=0, timeout=30, verify=True, headers=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.verify = verify
+        self.headers = dict(headers or {})
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        """Create a session with a pooled adapter for http and https"""
+        session = requests.Session()
+        session.verify = self.verify
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=self.max_retries
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def session(self):
+        """Return the shared session, creating it on first use"""
+        with self._lock:
+            if self._session is None:
+                self._session = self._create_session()
+            return self._session
+
+    def fetch(self, url, **kwargs):
+        """GET a URL through the shared pooled session"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        """Close the session and release pooled connections"""
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into a single execution
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight block and receive the same result or exception.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Run fn once for all concurrent callers of key"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds to wait"""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class _HostState:
+    """Scheduling state of a single host"""
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.next_allowed = 0.0
+        self.blocked_until = 0.0
+        self.latency = None
+        self.last_decrease = 0.0
+
+
+class HostScheduler:
+    """Per-host politeness scheduler with adaptive (AIMD) concurrency
+
+    Each host gets a cap on requests per second, a block honouring
+    Retry-After (or, without one, an exponential backoff of
+    ``retry_backoff * 2 ** attempt`` seconds), never longer than
+    ``max_retry_backoff``, and a concurrency limit that grows by one slot per window
+    of successful requests and halves on throttling responses (429/503),
+    network errors or latency above the target.
+    """
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, max_rps=None, max_concurrency=16, min_concurrency=1,
+                 initial_concurrency=None, latency_target=None, backoff=0.5,
+                 decrease_cooldown=1.0, retry_backoff=1.0, max_retry_backoff=60.0):
+        self.min_interval = 1.0 / max_rps if max_rps else 0.0
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.initial_concurrency = initial_concurrency or max_concurrency
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.decrease_cooldown = decrease_cooldown
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self._hosts = {}
+        self._cond = threading.Condition()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = _HostState(self.initial_concurrency)
+            self._hosts[host] = state
+        return state
+
+    def _try_acquire(self, host):
+        """Take a slot: 0 on success, seconds to wait, or None until a release"""
+        state = self._state(host)
+        now = time.monotonic()
+        wait = max(state.blocked_until - now, state.next_allowed - now)
+        if wait > 0:
+            return wait
+        if state.in_flight >= int(state.limit):
+            return None
+        state.in_flight += 1
+        state.next_allowed = now + self.min_interval
+        return 0
+
+    def acquire(self, host):
+        """Block the calling thread until a request to host may start"""
+        with self._cond:
+            while True:
+                wait = self._try_acquire(host)
+                if wait == 0:
+                    return
+                self._cond.wait(timeout=wait)
+
+    async def acquire_async(self, host):
+        """Wait on the event loop until a request to host may start"""
+        while True:
+            with self._cond:
+                wait = self._try_acquire(host)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait if wait is not None else 0.05)
+
+    def release(self, host, status_code=None, latency=None, retry_after=None, error=False, attempt=None):
+        """Finish a request and adapt the host's limits to its outcome
+
+        ``attempt`` is the zero-based try of a throttled request; without a
+        Retry-After the host is then blocked for an exponential backoff.
+        """
+        with self._cond:
+            state = self._state(host)
+            state.in_flight = max(0, state.in_flight - 1)
+            now = time.monotonic()
+
+            if not retry_after and attempt is not None and status_code in self.THROTTLE_STATUSES:
+                retry_after = min(self.max_retry_backoff, self.retry_backoff * 2 ** attempt)
+            if retry_after:
+                # A server asking for hours must not stall every worker on the host
+                retry_after = min(retry_after, self.max_retry_backoff)
+                state.blocked_until = max(state.blocked_until, now + retry_after)
+            if latency is not None:
+                state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+
+            congested = error or status_code in self.THROTTLE_STATUSES or (
+                self.latency_target and state.latency is not None
+                and state.latency > self.latency_target
+            )
+            if congested:
+                if now - state.last_decrease >= self.decrease_cooldown:
+                    state.limit = max(self.min_concurrency, state.limit * self.backoff)
+                    state.last_decrease = now
+            elif status_code is not None and status_code < 400:
+                state.limit = min(self.max_concurrency, state.limit + 1.0 / state.limit)
+
+            self._cond.notify_all()
+
+    def limit(self, host):
+        """Current concurrency limit for a host"""
+        with self._cond:
+            return int(self._state(host).limit)
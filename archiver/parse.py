@@ -0,0 +1,137 @@
+# archiver/parse.py
+from bs4 import BeautifulSoup, FeatureNotFound
+
+# Tried in order when no parser is requested; lxml is C-backed and several
+# times faster than the pure-Python html.parser on large pages
+PREFERRED_PARSERS = ('lxml', 'html.parser')
+
+
+def resolve_parser(name=None):
+    """Return a usable BeautifulSoup parser name, preferring ``name``"""
+    candidates = (name,) + PREFERRED_PARSERS if name else PREFERRED_PARSERS
+    for candidate in candidates:
+        try:
+            BeautifulSoup('', candidate)
+            return candidate
+        except FeatureNotFound:
+            continue
+    return 'html.parser'
+
+
+class ParsedPage:
+    """A parsed page and every tag its rewrite touches, found in one tree walk
+
+    Replaces a separate find_all() pass per tag type: images, stylesheets,
+    scripts, icons and anchors are bucketed as the tree is walked once,
+    together with any tag carrying an inline ``style``.
+    """
+
+    def __init__(self, soup):
+        self.soup = soup
+        self.images = []
+        self.stylesheets = []
+        self.scripts = []
+        self.icons = []
+        self.anchors = []
+        self.styles = []
+
+        for tag in soup.find_all(True):
+            name = tag.name
+            if name == 'img':
+                self.images.append(tag)
+            elif name == 'link':
+                rel = [value.lower() for value in tag.get('rel') or ()]
+                if 'stylesheet' in rel:
+                    self.stylesheets.append(tag)
+                elif 'icon' in rel:
+                    self.icons.append(tag)
+            elif name == 'script':
+                if tag.has_attr('src'):
+                    self.scripts.append(tag)
+            elif name == 'a':
+                if tag.has_attr('href'):
+                    self.anchors.append(tag)
+
+            if tag.has_attr('style'):
+                self.styles.append(tag)
+
+    @classmethod
+    def parse(cls, markup, parser='html.parser'):
+        """Parse markup and collect its rewrite targets"""
+        return cls(BeautifulSoup(markup, parser))
+
+    def __str__(self):
+        return str(self.soup)
+
+
+def parse_srcset(value):
+    """Parse a srcset attribute into (url, width, density) candidates
+
+    Follows the HTML parsing rules: a URL runs until whitespace, so commas
+    inside it (as in CDN transformation paths) are kept, and a comma only
+    ends a candidate after its URL or descriptors. Width is set for ``480w``
+    descriptors and density for ``2x`` ones; a candidate without a
+    descriptor has density 1, and one with invalid descriptors is skipped.
+    """
+    candidates = []
+    position, length = 0, len(value)
+    while position < length:
+        # Skip separators between candidates
+        while position < length and (value[position].isspace() or value[position] == ','):
+            position += 1
+        start = position
+        while position < length and not value[position].isspace():
+            position += 1
+        url = value[start:position]
+        if not url:
+            break
+
+        descriptors = []
+        if url.endswith(','):
+            # The comma ends the candidate: no descriptors
+            url = url.rstrip(',')
+        else:
+            token, in_parens = '', False
+            while position < length:
+                char = value[position]
+                position += 1
+                if in_parens:
+                    in_parens = char != ')'
+                    token += char
+                elif char == ',':
+                    break
+                elif char.isspace():
+                    if token:
+                        descriptors.append(token)
+                    token = ''
+                else:
+                    in_parens = char == '('
+                    token += char
+            if token:
+                descriptors.append(token)
+        if not url:
+            continue
+
+        width = density = None
+        valid = True
+        for descriptor in descriptors:
+            kind, number = descriptor[-1:].lower(), descriptor[:-1]
+            try:
+                if kind == 'w' and width is None and density is None:
+                    width = int(number)
+                    valid = valid and width > 0
+                elif kind == 'x' and width is None and density is None:
+                    density = float(number)
+                    valid = valid and density >= 0
+                elif kind == 'h':
+                    continue
+                else:
+                    valid = False
+            except ValueError:
+                valid = False
+        if not valid:
+            continue
+        if width is None and density is None:
+            density = 1.0
+        candidates.append((url, width, density))
+    return candidates
@@ -0,0 +1,95 @@
+# archiver/streaming.py
+from html import escape
+from html.parser import HTMLParser
+
+# Characters handed to the tokenizer at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunks(text, size=STREAM_CHUNK_SIZE):
+    """Split text already in memory into chunks for the streaming rewriter"""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def format_start_tag(tag):
+    """Serialize only the start tag of a BeautifulSoup element"""
+    parts = [tag.name]
+    for name, value in tag.attrs.items():
+        if isinstance(value, (list, tuple)):
+            value = ' '.join(value)
+        parts.append(name if value is None else f'{name}="{escape(value)}"')
+    return f"<{' '.join(parts)}>"
+
+
+class StreamingRewriter(HTMLParser):
+    """Rewrite an HTML token stream into a writer without building a tree
+
+    Markup is fed in chunks and written out as it is tokenized, so memory
+    stays bounded by the chunk size whatever the page size. Every start tag
+    is offered to ``rewrite(name, attrs, raw)``, which returns None to keep
+    the original, or ``(markup, drop_content)`` to replace it; with
+    ``drop_content`` the element's original content is skipped up to its end
+    tag (used when a script's src is inlined). ``head_end`` is written just
+    before ``</head>``. Everything else is copied through verbatim.
+    """
+
+    def __init__(self, write, rewrite, head_end=None):
+        super().__init__(convert_charrefs=False)
+        self.write = write
+        self.rewrite = rewrite
+        self.head_end = head_end
+        self._dropping = None
+
+    def _start(self, tag, attrs):
+        raw = self.get_starttag_text()
+        replacement = self.rewrite(tag, attrs, raw)
+        if replacement is None:
+            self.write(raw)
+            return
+        markup, drop_content = replacement
+        self.write(markup)
+        if drop_content:
+            self._dropping = tag
+
+    def handle_starttag(self, tag, attrs):
+        if self._dropping is None:
+            self._start(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        if self._dropping is None:
+            self._start(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if self._dropping is not None:
+            if tag != self._dropping:
+                return
+            self._dropping = None
+        if tag == 'head' and self.head_end:
+            self.write(self.head_end)
+        self.write(f"</{tag}>")
+
+    def _copy(self, markup):
+        if self._dropping is None:
+            self.write(markup)
+
+    def handle_data(self, data):
+        self._copy(data)
+
+    def handle_entityref(self, name):
+        self._copy(f"&{name};")
+
+    def handle_charref(self, name):
+        self._copy(f"&#{name};")
+
+    def handle_comment(self, data):
+        self._copy(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self._copy(f"<!{decl}>")
+
+    def handle_pi(self, data):
+        self._copy(f"<?{data}>")
+
+    def unknown_decl(self, data):
+        self._copy(f"<![{data}]>")
@@ -0,0 +1,219 @@
+# archiver/transform.py
+import base64
+from io import BytesIO
+from PIL import Image, features
+
+# CPU-bound stages of a page rewrite as plain functions of bytes and numbers,
+# so they can run in a process pool as well as in the calling thread.
+
+
+# Lowest quality the search will go to
+MIN_JPEG_QUALITY = 30
+# Stop the search once the best fitting quality is within this many steps
+QUALITY_PRECISION = 2
+# Trial encodes use a copy scaled down to at most this many pixels
+TRIAL_PIXELS = 256 * 256
+
+# Output formats: Pillow name, MIME type and whether transparency survives
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', False),
+    'webp': ('WEBP', 'image/webp', True),
+    'avif': ('AVIF', 'image/avif', True),
+}
+
+
+def format_available(name):
+    """Check if this Pillow build can encode an output format"""
+    if name not in IMAGE_FORMATS:
+        return False
+    return name == 'jpeg' or features.check(name)
+
+
+def _has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def _flatten(img):
+    """Convert an image once to a mode JPEG can store, compositing alpha on white"""
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA'):
+        # Handle transparency
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def _prepare(img, name):
+    """Convert an image once to a mode the output format can store"""
+    if not IMAGE_FORMATS[name][2]:
+        return _flatten(img)
+    if _has_alpha(img):
+        return img if img.mode == 'RGBA' else img.convert('RGBA')
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+def _encode(img, name, quality):
+    output = BytesIO()
+    if name == 'jpeg':
+        img.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    elif name == 'webp':
+        img.save(output, 'WEBP', quality=quality, method=4)
+    else:
+        img.save(output, IMAGE_FORMATS[name][0], quality=quality)
+    return output.getvalue()
+
+
+def _estimate_quality(img, name, target_size, max_quality, full_size=None):
+    """Guess the quality that fits target_size
+
+    ``full_size`` is the size of a full encode at max_quality when known;
+    otherwise it is extrapolated from an encode of a scaled-down copy.
+    """
+    pixels = img.width * img.height
+    if full_size is None:
+        if pixels <= TRIAL_PIXELS:
+            return (MIN_JPEG_QUALITY + max_quality + 1) // 2
+        scale = (TRIAL_PIXELS / pixels) ** 0.5
+        trial = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+        full_size = len(_encode(trial, name, max_quality)) * pixels / (trial.width * trial.height)
+    if full_size <= target_size:
+        return max_quality
+    guess = MIN_JPEG_QUALITY + (max_quality - MIN_JPEG_QUALITY) * target_size / full_size
+    return max(MIN_JPEG_QUALITY, min(max_quality, round(guess)))
+
+
+def _search_quality(img, name, target_size, max_quality, full_size=None):
+    """Bisect for the highest quality that fits, returning (data, quality, encodes)
+
+    If even the lowest quality does not fit, the lowest quality encode is
+    returned. The count includes the trial encode of the estimate.
+    """
+    probe = _estimate_quality(img, name, target_size, max_quality, full_size)
+    encodes = 1 if full_size is None and img.width * img.height > TRIAL_PIXELS else 0
+
+    low, high = MIN_JPEG_QUALITY, max_quality
+    if full_size is not None:
+        # The encode at max_quality is known not to fit
+        high = max_quality - 1
+        probe = min(probe, high)
+    best = None
+    smallest = None
+    while low <= high:
+        data = _encode(img, name, probe)
+        encodes += 1
+        if len(data) <= target_size:
+            best = (probe, data)
+            low = probe + 1
+        else:
+            high = probe - 1
+            if probe == MIN_JPEG_QUALITY:
+                smallest = (probe, data)
+        if best and high - best[0] < QUALITY_PRECISION:
+            break
+        probe = (low + high + 1) // 2
+
+    if best is None:
+        if smallest is None:
+            smallest = (MIN_JPEG_QUALITY, _encode(img, name, MIN_JPEG_QUALITY))
+            encodes += 1
+        best = smallest
+    return best[1], best[0], encodes
+
+
+def compress_image_data(img_data, max_size_kb=500, quality=95):
+    """Recompress an image as JPEG to fit max_size_kb, returning (data, quality used, encodes)
+
+    Standalone JPEG-only recompression behind WebsiteArchiver.compress_image;
+    the page rewrite uses transcode_image, which also downscales and picks
+    the output format.
+
+    The highest JPEG quality that fits is found by bisection, starting from a
+    guess based on a scaled-down trial encode, so a large image takes a
+    handful of full encodes instead of one per 5 quality steps. The quality
+    used is None when the image was already small enough.
+    """
+    # Decode first so undecodable data fails loudly
+    img = Image.open(BytesIO(img_data))
+
+    # If image is already small enough, return original
+    if len(img_data) < max_size_kb * 1024:
+        return img_data, None, 0
+
+    return _search_quality(_flatten(img), 'jpeg', max_size_kb * 1024, quality)
+
+
+def optimize_image(img_data, max_size_kb=500, quality=95, max_width=None, max_height=None,
+                   formats=('jpeg',)):
+    """Downscale an image to its display size and re-encode it in the smallest format
+
+    Returns (data, content type, quality used, encodes). The content type and
+    quality are None when the original is kept: it is animated, or it is
+    within max_size_kb and no larger than the display size, or re-encoding
+    did not make it smaller. Transparent images only use formats that keep
+    transparency, unless none is allowed, in which case they are flattened.
+    """
+    img = Image.open(BytesIO(img_data))
+    if getattr(img, 'n_frames', 1) > 1:
+        return img_data, None, None, 0
+
+    resized = (max_width and img.width > max_width) or (max_height and img.height > max_height)
+    if resized:
+        img.thumbnail((max_width or img.width, max_height or img.height), Image.LANCZOS)
+    target_size = max_size_kb * 1024
+    if not resized and len(img_data) < target_size:
+        return img_data, None, None, 0
+
+    usable = [name for name in formats if format_available(name)] or ['jpeg']
+    if _has_alpha(img):
+        usable = [name for name in usable if IMAGE_FORMATS[name][2]] or usable
+
+    # Pick the format that is smallest at the starting quality
+    encodes = 0
+    best = None
+    for name in usable:
+        prepared = _prepare(img, name)
+        data = _encode(prepared, name, quality)
+        encodes += 1
+        if best is None or len(data) < len(best[2]):
+            best = (name, prepared, data)
+    name, prepared, data = best
+
+    used_quality = quality
+    if len(data) > target_size:
+        data, used_quality, searched = _search_quality(prepared, name, target_size, quality, len(data))
+        encodes += searched
+
+    if len(data) >= len(img_data):
+        return img_data, None, None, encodes
+    return data, IMAGE_FORMATS[name][1], used_quality, encodes
+
+
+def to_data_url(data, content_type):
+    """Encode bytes as a base64 data URL"""
+    encoded = base64.b64encode(data).decode('utf-8')
+    return f"data:{content_type};base64,{encoded}"
+
+
+def transcode_image(img_data, content_type, compress=True, max_size_kb=500, quality=95,
+                    max_width=None, max_height=None, formats=('jpeg',)):
+    """Optimize an image, returning (data, content type, quality used, encodes, error)
+
+    A failure keeps the original bytes and reports the error as text, since
+    a worker process cannot log to the archiver.
+    """
+    encodes = 0
+    used_quality = None
+    error = None
+    if compress:
+        try:
+            img_data, new_type, used_quality, encodes = optimize_image(
+                img_data, max_size_kb, quality, max_width, max_height, formats
+            )
+            content_type = new_type or content_type
+        except Exception as e:
+            error = f"Error compressing image: {str(e)}"
+    return img_data, content_type, used_quality, encodes, error
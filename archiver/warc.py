@@ -0,0 +1,224 @@
+# archiver/warc.py
+import base64
+import glob
+import gzip
+import hashlib
+import json
+import os
+import threading
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from http.client import responses as HTTP_REASONS
+from urllib.parse import urlsplit
+
+SOFTWARE = "website-archiver"
+WACZ_VERSION = "1.1.1"
+
+# Hop-by-hop and encoding headers that no longer describe the recorded body:
+# requests hands over the decoded payload, so its length is recomputed
+DROPPED_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length', 'connection', 'keep-alive')
+
+
+def surt(url):
+    """Sort-friendly URI Reordering Transform used as the CDX key"""
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    key = ','.join(reversed(host.split('.')))
+    if parts.port and parts.port not in (80, 443):
+        key += f":{parts.port}"
+    path = parts.path.lower() or '/'
+    query = '&'.join(sorted(parts.query.lower().split('&'))) if parts.query else ''
+    return f"{key}){path}" + (f"?{query}" if query else '')
+
+
+def _digest(data):
+    return "sha1:" + base64.b32encode(hashlib.sha1(data).digest()).decode('ascii')
+
+
+def _header_block(lines):
+    return ''.join(f"{line}\r\n" for line in lines).encode('utf-8') + b"\r\n"
+
+
+class WarcWriter:
+    """Append request/response records to gzip-per-record WARC files
+
+    Each record is its own gzip member, so any record can be read back from
+    its offset alone. A new file is started once the current one reaches
+    ``max_size`` bytes. Every response is indexed as it is written into an
+    unsorted CDXJ file and HTML pages are listed in pages.jsonl, which
+    package_wacz() turns into a WACZ. A URL is recorded once per writer.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, directory, prefix='archive', max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        self.index_path = os.path.join(directory, "index.cdxj")
+        self.pages_path = os.path.join(directory, "pages.jsonl")
+        self.records = 0
+        self._file = None
+        self._filename = None
+        self._recorded = set()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index = open(self.index_path, 'a', encoding='utf-8')
+        self._pages = open(self.pages_path, 'a', encoding='utf-8')
+
+    @property
+    def warc_paths(self):
+        """Every WARC file of this writer's prefix, including earlier runs"""
+        return sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}-*.warc.gz")))
+
+    def _open(self, now):
+        """Start the next WARC file, beginning with a warcinfo record"""
+        serial = len(self.warc_paths)
+        self._filename = f"{self.prefix}-{now:%Y%m%d%H%M%S}-{serial:05d}.warc.gz"
+        self._file = open(os.path.join(self.directory, self._filename), 'ab')
+        info = _header_block([
+            f"software: {SOFTWARE}",
+            "format: WARC File Format 1.1",
+            "conformsTo: http://iipc.github.io/warc-specifications/specifications/warc-format/warc-1.1/",
+        ])[:-2]
+        self._file.write(self._record('warcinfo', None, now, 'application/warc-fields', info,
+                                      [f"WARC-Filename: {self._filename}"]))
+
+    @staticmethod
+    def _record(warc_type, url, now, content_type, block, extra=(), record_id=None):
+        """Serialize one record as a standalone gzip member"""
+        lines = [
+            "WARC/1.1",
+            f"WARC-Type: {warc_type}",
+            f"WARC-Record-ID: {record_id or f'<urn:uuid:{uuid.uuid4()}>'}",
+            f"WARC-Date: {now:%Y-%m-%dT%H:%M:%SZ}",
+        ]
+        if url:
+            lines.append(f"WARC-Target-URI: {url}")
+        lines += list(extra)
+        lines += [
+            f"WARC-Block-Digest: {_digest(block)}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(block)}",
+        ]
+        return gzip.compress(_header_block(lines) + block + b"\r\n\r\n")
+
+    def has_record(self, url):
+        """Check if a URL was already recorded by this writer"""
+        with self._lock:
+            return url in self._recorded
+
+    def write_exchange(self, url, status, headers, body, reason=None, request_headers=None, method='GET'):
+        """Record a request and its response; False if the URL was already recorded"""
+        with self._lock:
+            if url in self._recorded:
+                return False
+            self._recorded.add(url)
+
+        now = datetime.now(timezone.utc)
+        parts = urlsplit(url)
+        target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        request_lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}"]
+        request_lines += [f"{name}: {value}" for name, value in (request_headers or {}).items()
+                          if name.lower() != 'host']
+
+        response_lines = [f"HTTP/1.1 {status} {reason or HTTP_REASONS.get(status, '')}".rstrip()]
+        response_lines += [f"{name}: {value}" for name, value in (headers or {}).items()
+                           if name.lower() not in DROPPED_HEADERS]
+        response_lines.append(f"Content-Length: {len(body)}")
+
+        response_id = f"<urn:uuid:{uuid.uuid4()}>"
+        payload_digest = _digest(body)
+        response_record = self._record(
+            'response', url, now, 'application/http;msgtype=response',
+            _header_block(response_lines) + body,
+            [f"WARC-Payload-Digest: {payload_digest}"], record_id=response_id
+        )
+        request_record = self._record(
+            'request', url, now, 'application/http;msgtype=request',
+            _header_block(request_lines), [f"WARC-Concurrent-To: {response_id}"]
+        )
+
+        content_type = next((value for name, value in (headers or {}).items() if name.lower() == 'content-type'), '')
+        mime = content_type.split(';')[0].strip() or 'unk'
+        with self._lock:
+            if self._file is None:
+                self._open(now)
+            offset = self._file.tell()
+            self._file.write(response_record)
+            self._file.write(request_record)
+            self.records += 1
+            entry = {
+                'url': url, 'mime': mime, 'status': str(status), 'digest': payload_digest,
+                'length': str(len(response_record)), 'offset': str(offset), 'filename': self._filename,
+            }
+            self._index.write(f"{surt(url)} {now:%Y%m%d%H%M%S} {json.dumps(entry)}\n")
+            if mime == 'text/html' and 200 <= status < 300:
+                self._pages.write(json.dumps({'url': url, 'ts': f"{now:%Y-%m-%dT%H:%M:%SZ}"}) + "\n")
+            if self._file.tell() >= self.max_size:
+                self._file.close()
+                self._file = None
+        return True
+
+    def close(self):
+        """Close the current WARC file and flush the index"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._index.close()
+            self._pages.close()
+
+    def package_wacz(self, path, title=None):
+        """Bundle the WARC files, a sorted CDXJ index and the page list into a WACZ"""
+        self.close()
+        return package_wacz(path, self.warc_paths, self.index_path, self.pages_path, title)
+
+
+def package_wacz(path, warc_paths, index_path, pages_path, title=None):
+    """Write a WACZ zip from WARC files, their CDXJ index and a pages.jsonl"""
+    with open(index_path, encoding='utf-8') as f:
+        index = ''.join(sorted(f))
+    with open(pages_path, encoding='utf-8') as f:
+        header = json.dumps({'format': 'json-pages-1.0', 'id': 'pages', 'title': 'All Pages'})
+        pages = header + "\n" + f.read()
+
+    resources = []
+    # Members are stored uncompressed: WARC records are already gzipped and
+    # replay tools seek straight into them
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as wacz:
+        def add(name, data=None, source=None):
+            digest = hashlib.sha256()
+            if source is None:
+                data = data.encode('utf-8')
+                digest.update(data)
+                wacz.writestr(name, data)
+                size = len(data)
+            else:
+                with open(source, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+                wacz.write(source, name)
+                size = os.path.getsize(source)
+            resources.append({
+                'name': os.path.basename(name), 'path': name,
+                'hash': f"sha256:{digest.hexdigest()}", 'bytes': size,
+            })
+
+        for warc_path in warc_paths:
+            add(f"archive/{os.path.basename(warc_path)}", source=warc_path)
+        add("indexes/index.cdxj", index)
+        add("pages/pages.jsonl", pages)
+
+        datapackage = {
+            'profile': 'data-package',
+            'wacz_version': WACZ_VERSION,
+            'title': title or os.path.splitext(os.path.basename(path))[0],
+            'created': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'software': SOFTWARE,
+            'resources': resources,
+        }
+        wacz.writestr("datapackage.json", json.dumps(datapackage, indent=2))
+    return path
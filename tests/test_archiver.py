@@ -11,8 +11,31 @@ import base64
 import json
 from pathlib import Path
 from archiver.core import WebsiteArchiver
+from archiver.fetch import Fetcher, HostScheduler, SingleFlight, build_response, parse_retry_after
+from archiver.async_core import AsyncWebsiteArchiver
+from archiver.browser import (
+    PageClassifier, WebDriverPool, block_resources, blocked_content_settings, blocked_url_patterns,
+    install_network_tracker, wait_for_page_ready
+)
+from archiver.assets import AssetStore, asset_extension
+from archiver.cache import AssetCache, ImageCache
+from archiver.parse import ParsedPage, parse_srcset, resolve_parser
+from archiver.streaming import StreamingRewriter, iter_chunks
+from archiver.warc import WarcWriter, surt
+from archiver.transform import compress_image_data, optimize_image, transcode_image
+from archiver.crawl import (
+    VisitedSet, BloomVisitedSet, CrawlJournal, URLCanonicalizer, create_visited_set
+)
 import requests
 import gzip
+import fnmatch
+import hashlib
+import zipfile
+import asyncio
+import aiohttp
+import http.server
+import threading
+import time
 
 @pytest.fixture
 def temp_dir():
@@ -21,6 +44,12 @@ def temp_dir():
     yield temp_path
     shutil.rmtree(temp_path)
 
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """Keep the per-user image cache of every test in a temporary directory"""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
 @pytest.fixture
 def archiver(temp_dir):
     """Create a test archiver instance"""
@@ -106,7 +135,7 @@ class TestWebsiteArchiver:
 
     def test_initialization(self, archiver, temp_dir):
         """Test archiver initialization"""
-        assert archiver.base_url == "https://example.com"
+        assert archiver.base_url == "https://example.com/"
         assert archiver.domain == "example.com"
         assert archiver.compress_images is True
         assert archiver.wait_for_ajax is True
@@ -141,7 +170,7 @@ class TestWebsiteArchiver:
         result = archiver.compress_image(invalid_image)
         assert result == invalid_image
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_process_image_tag(self, mock_get, archiver, sample_image):
         """Test processing of image tags"""
         mock_get.return_value = Mock(
@@ -173,7 +202,7 @@ class TestWebsiteArchiver:
         assert result == sample_html
         assert mock_driver.get.called_with("https://example.com")
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_process_css(self, mock_get, archiver, mock_responses):
         """Test CSS processing"""
         mock_get.return_value = mock_responses['css']
@@ -216,7 +245,7 @@ class TestWebsiteArchiver:
             saved_content = f.read()
         assert saved_content == large_html
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_full_page_processing(self, mock_get, archiver, mock_responses, sample_html):
         """Test complete page processing"""
         def mock_get_response(*args, **kwargs):
@@ -253,5 +282,1584 @@ class TestWebsiteArchiver:
             log_content = f.read()
         assert "Error processing" in log_content
 
+class TestCrawlFrontier:
+    """Test suite for link discovery and the crawl frontier"""
+
+    def _queued(self, archiver):
+        items = []
+        while not archiver.queue.empty():
+            items.append(archiver.queue.get_nowait())
+        return items
+
+    def test_links_discovered_and_rewritten(self, archiver):
+        """Test that in-scope links are queued and pointed at local copies"""
+        html = """
+        <a href="/docs/guide#intro">Guide</a>
+        <a href="page2.html">Page 2</a>
+        <a href="https://other.com/x">External</a>
+        <a href="/files/manual.pdf">PDF</a>
+        <a href="mailto:someone@example.com">Mail</a>
+        """
+        result = archiver._process_html("https://example.com/blog/post.html", html, depth=1)
+        soup = BeautifulSoup(result, 'html.parser')
+        hrefs = [a['href'] for a in soup.find_all('a')]
+
+        assert self._queued(archiver) == [
+            ("https://example.com/docs/guide", 2),
+            ("https://example.com/blog/page2.html", 2),
+        ]
+        assert hrefs == [
+            "../docs/guide/index.html#intro",
+            "page2.html",
+            "https://other.com/x",
+            "https://example.com/files/manual.pdf",
+            "mailto:someone@example.com",
+        ]
+
+    def test_duplicate_links_queued_once(self, archiver):
+        """Test that a page linked twice enters the frontier once"""
+        html = '<a href="/a.html">A</a><a href="/a.html#top">A again</a>'
+        archiver._process_html("https://example.com/", html)
+        assert self._queued(archiver) == [("https://example.com/a.html", 1)]
+
+    def test_links_to_visited_pages_rewritten(self, archiver):
+        """Test that links to archived pages, including the page itself, point at local copies"""
+        archiver.visited_urls.add("https://example.com/")
+        archiver.discovered_urls.add("https://example.com/")
+        archiver.visited_urls.add("https://example.com/about")
+        archiver.discovered_urls.add("https://example.com/about")
+        html = '<a href="/">Home</a><a href="/about">About</a>'
+        result = archiver._process_html("https://example.com/", html)
+        soup = BeautifulSoup(result, 'html.parser')
+        assert [a['href'] for a in soup.find_all('a')] == ["index.html", "about/index.html"]
+        assert self._queued(archiver) == []
+
+    @patch('requests.Session.get')
+    def test_non_canonical_start_url(self, mock_get, temp_dir):
+        """Test that a start URL with uppercase host, default port and tracking params is crawled"""
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': 'text/html'}, b'<html><body><a href="/about">About</a></body></html>'
+        )
+        archiver = WebsiteArchiver("https://Example.com:443/?utm_source=feed", temp_dir,
+                                   wait_for_ajax=False, max_threads=1)
+        assert archiver.base_url == "https://example.com/"
+        assert archiver.domain == "example.com"
+
+        assert archiver.start_archive()
+        assert len(archiver.visited_urls) == 2
+        assert os.path.exists(os.path.join(temp_dir, "index.html"))
+        assert os.path.exists(os.path.join(temp_dir, "about", "index.html"))
+
+    @patch('requests.Session.get')
+    def test_pagination_pages_saved_separately(self, mock_get, temp_dir):
+        """Test that pages differing only in their query get their own files and links"""
+        pages = {
+            "https://example.com/": b'<html><body><a href="/list?page=1">1</a><a href="/list?page=2">2</a></body></html>',
+            "https://example.com/list?page=1": b'<html><body>first page</body></html>',
+            "https://example.com/list?page=2": b'<html><body>second page</body></html>',
+        }
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': 'text/html'}, pages[url]
+        )
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, max_threads=1)
+        assert archiver.start_archive()
+
+        first = archiver._url_to_filepath("https://example.com/list?page=1")
+        second = archiver._url_to_filepath("https://example.com/list?page=2")
+        assert first == f"list/index-{hashlib.sha1(b'page=1').hexdigest()[:10]}.html"
+        assert first != second
+        with open(os.path.join(temp_dir, first), encoding='utf-8') as f:
+            assert 'first page' in f.read()
+        with open(os.path.join(temp_dir, second), encoding='utf-8') as f:
+            assert 'second page' in f.read()
+        with open(os.path.join(temp_dir, "index.html"), encoding='utf-8') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        assert [a['href'] for a in soup.find_all('a')] == [first, second]
+
+    def test_max_depth(self, temp_dir):
+        """Test that links beyond max_depth stay pointed at the live site"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, max_depth=1)
+        result = archiver._process_html("https://example.com/a/b.html", '<a href="c.html">C</a>', depth=1)
+        assert self._queued(archiver) == []
+        assert 'href="https://example.com/a/c.html"' in result
+
+    def test_max_pages(self, temp_dir):
+        """Test that the frontier stops growing at max_pages"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, max_pages=2)
+        html = "".join(f'<a href="/p{i}.html">{i}</a>' for i in range(5))
+        archiver._process_html("https://example.com/", html)
+        assert [url for url, _ in self._queued(archiver)] == [
+            "https://example.com/p0.html",
+            "https://example.com/p1.html",
+        ]
+
+class TestURLCanonicalizer:
+    """Test suite for URL canonicalization"""
+
+    @pytest.mark.parametrize("url,expected", [
+        ("https://example.com", "https://example.com/"),
+        ("HTTPS://Example.COM:443/Page", "https://example.com/Page"),
+        ("http://example.com:80/a", "http://example.com/a"),
+        ("http://example.com:8080/a", "http://example.com:8080/a"),
+        ("https://example.com/page#section", "https://example.com/page"),
+        ("https://example.com/page?b=1&a=2", "https://example.com/page?a=2&b=1"),
+        ("https://example.com/page?a=2&b=1", "https://example.com/page?a=2&b=1"),
+        ("https://example.com/p?id=3&utm_source=x&fbclid=y", "https://example.com/p?id=3"),
+        ("https://example.com/p?tag=b&tag=a", "https://example.com/p?tag=b&tag=a"),
+        ("https://example.com/page/", "https://example.com/page/"),
+        ("https://example.com/search?edit", "https://example.com/search?edit"),
+        ("https://example.com/s?q=a%20b&a=x;y", "https://example.com/s?a=x;y&q=a%20b"),
+        ("https://example.com/s?q=%ZZ&utm%5Fsource=x", "https://example.com/s?q=%ZZ"),
+    ])
+    def test_default_rules(self, url, expected):
+        """Test the default canonical form"""
+        assert URLCanonicalizer()(url) == expected
+
+    def test_configurable_rules(self):
+        """Test custom tracking patterns and trailing slash stripping"""
+        canonicalize = URLCanonicalizer(drop_params=['session*'], sort_query=False,
+                                        strip_trailing_slash=True)
+        assert canonicalize("https://example.com/page/?z=1&sessionid=9&utm_x=2") == \
+            "https://example.com/page?z=1&utm_x=2"
+        assert canonicalize("https://example.com/") == "https://example.com/"
+
+    @patch('requests.Session.get')
+    def test_duplicate_variants_fetched_once(self, mock_get, archiver, mock_responses):
+        """Test that equivalent links are queued once and assets cached under one key"""
+        mock_get.return_value = mock_responses['image']
+        html = """
+        <a href="/page?b=1&a=2">1</a><a href="/page?a=2&b=1#top">2</a>
+        <a href="/page?a=2&b=1&utm_campaign=x">3</a>
+        <img src="/logo.png?v=1&utm_source=y"><img src="/logo.png?v=1">
+        """
+        archiver._process_html("https://example.com/", html)
+        assert archiver.queue.qsize() == 1
+        assert archiver.queue.get_nowait() == ("https://example.com/page?a=2&b=1", 1)
+        assert mock_get.call_count == 1
+        archiver._shutdown_asset_pool()
+
+class TestVisitedSet:
+    """Test suite for the visited URL structures"""
+
+    @pytest.mark.parametrize("visited", [VisitedSet(), BloomVisitedSet(capacity=1000)])
+    def test_atomic_check_and_add(self, visited):
+        """Test that exactly one of many racing threads wins each URL"""
+        import threading
+        winners = []
+        barrier = threading.Barrier(8)
+
+        def race():
+            barrier.wait()
+            for i in range(200):
+                if visited.add(f"https://example.com/{i}"):
+                    winners.append(i)
+
+        threads = [threading.Thread(target=race) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(winners) == list(range(200))
+        assert len(visited) == 200
+        assert "https://example.com/5" in visited
+
+    def test_bloom_memory_bounded(self):
+        """Test that the Bloom filter size is fixed by capacity and error rate"""
+        visited = BloomVisitedSet(capacity=1_000_000, error_rate=0.01)
+        assert len(visited._bits) < 1.3 * 1024 * 1024
+        for i in range(10000):
+            visited.add(f"https://example.com/page/{i}")
+        false_positives = sum(f"https://example.com/other/{i}" in visited for i in range(10000))
+        assert false_positives < 100
+
+    def test_unknown_mode(self):
+        """Test that an unknown mode is rejected"""
+        with pytest.raises(ValueError):
+            create_visited_set("fuzzy")
+
+    @patch('requests.Session.get')
+    def test_page_processed_once(self, mock_get, archiver, mock_responses):
+        """Test that concurrent workers never process the same page twice"""
+        import threading
+        mock_get.return_value = mock_responses['html']
+        archiver.wait_for_ajax = False
+        threads = [
+            threading.Thread(target=archiver._process_url, args=("https://example.com/a.html",))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert mock_get.call_count == 1
+
+class TestCrawlJournal:
+    """Test suite for persistent, resumable crawl state"""
+
+    SITE = {
+        "https://example.com/": '<a href="/a.html">A</a><a href="/b.html">B</a>',
+        "https://example.com/a.html": '<a href="https://EXAMPLE.com">Home</a>',
+        "https://example.com/b.html": '<p>B</p>',
+    }
+
+    def _get(self, url, **kwargs):
+        if url not in self.SITE:
+            return build_response(url, 404, {}, b'')
+        return build_response(url, 200, {'content-type': 'text/html'},
+                              self.SITE[url].encode(), 'utf-8')
+
+    def _archiver(self, temp_dir, **kwargs):
+        return WebsiteArchiver("https://example.com", temp_dir, max_threads=2,
+                               wait_for_ajax=False, **kwargs)
+
+    @patch('requests.Session.get')
+    def test_statuses_recorded(self, mock_get, temp_dir):
+        """Test that every frontier URL ends up in the journal with its status"""
+        mock_get.side_effect = self._get
+        self.SITE = dict(self.SITE, **{"https://example.com/b.html": '<a href="/gone.html">x</a>'})
+        assert self._archiver(temp_dir).start_archive()
+
+        journal = CrawlJournal(os.path.join(temp_dir, "crawl_state.sqlite3"))
+        statuses = {url: status for url, _, status in journal.entries()}
+        journal.close()
+        assert statuses == {
+            "https://example.com/": "done",
+            "https://example.com/a.html": "done",
+            "https://example.com/b.html": "done",
+            "https://example.com/gone.html": "failed",
+        }
+
+    @patch('requests.Session.get')
+    def test_resume_skips_finished_pages(self, mock_get, temp_dir):
+        """Test that a resumed crawl only fetches pages left pending"""
+        mock_get.side_effect = self._get
+        journal = CrawlJournal(os.path.join(temp_dir, "crawl_state.sqlite3"))
+        journal.record_queued("https://example.com/", 0)
+        journal.record_done("https://example.com/")
+        journal.record_queued("https://example.com/a.html", 1)
+        journal.record_done("https://example.com/a.html")
+        journal.record_queued("https://example.com/b.html", 1)
+        journal.close()
+
+        archiver = self._archiver(temp_dir, resume=True)
+        assert archiver.start_archive()
+
+        fetched = [call.args[0] for call in mock_get.call_args_list]
+        assert fetched == ["https://example.com/b.html"]
+        assert os.path.exists(os.path.join(temp_dir, "b.html"))
+
+    @patch('requests.Session.get')
+    def test_fresh_run_resets_journal(self, mock_get, temp_dir):
+        """Test that a run without resume starts over"""
+        mock_get.side_effect = self._get
+        journal = CrawlJournal(os.path.join(temp_dir, "crawl_state.sqlite3"))
+        journal.record_queued("https://example.com/", 0)
+        journal.record_done("https://example.com/")
+        journal.close()
+
+        assert self._archiver(temp_dir).start_archive()
+        assert mock_get.call_count == 3
+
+class TestWebDriverPool:
+    """Test suite for the pool of headless browsers"""
+
+    def test_drivers_created_lazily_up_to_size(self):
+        """Test that drivers are created on demand and reused"""
+        pool = WebDriverPool(MagicMock, size=2)
+        with pool.checkout() as first:
+            with pool.checkout() as second:
+                assert first is not second
+        with pool.checkout() as again:
+            assert again in (first, second)
+        assert pool._created == 2
+
+    def test_recycled_after_max_pages(self):
+        """Test that a driver is quit and replaced after max pages"""
+        pool = WebDriverPool(MagicMock, size=1, max_pages_per_driver=2)
+        with pool.checkout() as first:
+            pass
+        with pool.checkout() as same:
+            assert same is first
+        first.quit.assert_called_once()
+        with pool.checkout() as replacement:
+            assert replacement is not first
+
+    def test_crashed_driver_discarded(self):
+        """Test that a page failure discards the driver"""
+        pool = WebDriverPool(MagicMock, size=1)
+        with pytest.raises(RuntimeError):
+            with pool.checkout() as crashed:
+                raise RuntimeError("chrome not reachable")
+        crashed.quit.assert_called_once()
+        with pool.checkout() as fresh:
+            assert fresh is not crashed
+
+    def test_checkout_waits_when_pool_full(self):
+        """Test that pages beyond the pool size wait for a free browser"""
+        import threading
+        import time
+        pool = WebDriverPool(MagicMock, size=1)
+        got = threading.Event()
+
+        def second():
+            with pool.checkout():
+                got.set()
+
+        with pool.checkout():
+            t = threading.Thread(target=second)
+            t.start()
+            time.sleep(0.1)
+            assert not got.is_set()
+        t.join(timeout=2)
+        assert got.is_set()
+
+    def test_archiver_renders_with_pool(self, temp_dir, sample_html):
+        """Test that capture_ajax_content checks out drivers from the pool"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, browser_pool_size=3)
+        drivers = []
+
+        def factory():
+            driver = MagicMock()
+            driver.page_source = sample_html
+            driver.get_log.return_value = []
+            drivers.append(driver)
+            return driver
+
+        archiver.driver_pool.factory = factory
+        assert archiver.capture_ajax_content("https://example.com") == sample_html
+        assert archiver.capture_ajax_content("https://example.com/a") == sample_html
+        assert archiver.driver_pool.size == 3
+        assert len(drivers) == 1
+        assert drivers[0].get.call_count == 2
+        archiver.driver_pool.close()
+        drivers[0].quit.assert_called_once()
+
+class TestPageReadiness:
+    """Test suite for event-driven page readiness"""
+
+    def test_tracker_installed_before_navigation(self):
+        """Test that the tracker is registered for every new document via CDP"""
+        driver = MagicMock()
+        assert install_network_tracker(driver) is True
+        command, params = driver.execute_cdp_cmd.call_args.args
+        assert command == 'Page.addScriptToEvaluateOnNewDocument'
+        assert '__archiverTracker' in params['source']
+
+        driver.execute_cdp_cmd.side_effect = Exception("not chrome")
+        assert install_network_tracker(driver) is False
+
+    def test_returns_once_quiet(self):
+        """Test that readiness polls quickly and returns as soon as the page settles"""
+        driver = MagicMock()
+        driver.execute_script.side_effect = [False, False, True]
+        waited = wait_for_page_ready(driver, quiet_period_ms=300, timeout=5, poll_interval=0.01)
+        assert waited < 1
+        assert driver.execute_script.call_count == 3
+        assert driver.execute_script.call_args.args[1] == 300
+
+    def test_render_reports_wait_without_fixed_sleep(self, temp_dir, sample_html):
+        """Test that rendering never sleeps a fixed delay and records the wait"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, quiet_period_ms=200)
+        driver = MagicMock(network_tracker_installed=True)
+        driver.page_source = sample_html
+        driver.get_log.return_value = []
+        archiver.driver_pool.factory = lambda: driver
+
+        with patch('time.sleep') as sleep:
+            assert archiver.capture_ajax_content("https://example.com") == sample_html
+        sleep.assert_not_called()
+        assert archiver.rendered_pages == 1
+        assert archiver.render_wait_seconds < 1
+        archiver.driver_pool.close()
+
+    def test_bodies_captured_from_browser(self, temp_dir):
+        """Test that XHR and asset bodies come from the browser, not a second download"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, classify_pages=False)
+        html = '<html><head></head><body><img src="/logo.png"><p>ok</p></body></html>'
+        png = BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(png, 'PNG')
+
+        def entry(request_id, url, resource_type, content_type='text/html'):
+            return {'message': json.dumps({'message': {
+                'method': 'Network.responseReceived',
+                'params': {'requestId': request_id, 'type': resource_type, 'response': {
+                    'url': url, 'status': 200, 'headers': {'Content-Type': content_type}
+                }}
+            }})}
+
+        bodies = {
+            '1': {'body': '{"items": [1, 2]}', 'base64Encoded': False},
+            '2': {'body': base64.b64encode(png.getvalue()).decode(), 'base64Encoded': True},
+        }
+        driver = MagicMock(network_tracker_installed=True)
+        driver.page_source = html
+        driver.execute_script.return_value = True
+        driver.get_log.return_value = [
+            entry('0', 'https://example.com/', 'Document'),
+            entry('1', 'https://example.com/api/items', 'XHR', 'application/json'),
+            entry('2', 'https://example.com/logo.png', 'Image', 'image/png'),
+            entry('3', 'https://cdn.other.com/lib.js', 'Script', 'text/javascript'),
+        ]
+        driver.execute_cdp_cmd.side_effect = lambda cmd, params: bodies[params['requestId']]
+        archiver.driver_pool.factory = lambda: driver
+
+        with patch('requests.Session.get') as mock_get:
+            archiver._process_url("https://example.com/")
+        mock_get.assert_not_called()
+        saved = (Path(temp_dir) / 'index.html').read_text()
+        assert 'window.ajaxData = {"https://example.com/api/items": "{\\"items\\": [1, 2]}"}' in saved
+        assert 'data:image/png;base64,' in saved
+        archiver.driver_pool.close()
+
+    def test_previous_page_log_discarded(self, temp_dir):
+        """Test that late XHRs of a pooled browser's previous page are not collected"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir)
+
+        def xhr(request_id, url):
+            return {'message': json.dumps({'message': {
+                'method': 'Network.responseReceived',
+                'params': {'requestId': request_id, 'type': 'XHR', 'response': {
+                    'url': url, 'status': 200, 'headers': {'Content-Type': 'application/json'}
+                }}
+            }})}
+
+        driver = MagicMock(network_tracker_installed=True)
+        driver.page_source = '<html><body></body></html>'
+        driver.execute_script.return_value = True
+        driver.get_log.side_effect = [
+            [xhr('1', 'https://example.com/api/poll')],
+            [xhr('2', 'https://example.com/api/b')],
+        ]
+        driver.execute_cdp_cmd.return_value = {'body': '{}', 'base64Encoded': False}
+        archiver.driver_pool.factory = lambda: driver
+
+        ajax_data = {}
+        archiver.capture_ajax_content("https://example.com/b", {}, ajax_data)
+        assert list(ajax_data) == ["https://example.com/api/b"]
+        archiver.driver_pool.close()
+
+    def test_ajax_data_scoped_to_page(self, temp_dir):
+        """Test that a saved page embeds only its own AJAX responses"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False)
+        page = "<html><head></head><body></body></html>"
+        archiver._save_html_page("https://example.com/a", page, {"https://example.com/api/a": "</script>"})
+        archiver._save_html_page("https://example.com/b", page, {"https://example.com/api/b": "b"})
+        archiver._save_html_page("https://example.com/c", page)
+
+        a = (Path(temp_dir) / 'a' / 'index.html').read_text()
+        b = (Path(temp_dir) / 'b' / 'index.html').read_text()
+        assert 'api/a' in a and 'api/b' not in a
+        assert 'api/b' in b and 'api/a' not in b
+        assert '<\\/script>' in a and a.count('</script>') == 1
+        assert 'ajaxData' not in (Path(temp_dir) / 'c' / 'index.html').read_text()
+
+class TestPageClassifier:
+    """Test suite for routing pages to the browser only when needed"""
+
+    ARTICLE = "<html><body><h1>Post</h1><p>" + "Plenty of server rendered text. " * 20 + "</p></body></html>"
+    SPA = '<html><body><div id="root"></div><script src="/static/js/main.3f9a2b1c.js"></script></body></html>'
+
+    def test_heuristics(self):
+        """Test the signals that send a page to the browser"""
+        classifier = PageClassifier()
+        assert classifier.inspect(self.ARTICLE) is None
+        assert classifier.inspect(self.SPA) == 'empty mount point'
+        assert classifier.inspect(
+            '<html><body><p>Hi</p><script src="/js/vendor.js"></script></body></html>'
+        ) == 'framework bundle without content'
+        assert classifier.inspect(
+            '<body><noscript>Please enable JavaScript to view this site</noscript></body>'
+        ) == 'noscript notice'
+        assert classifier.inspect(
+            self.ARTICLE.replace('</body>', '<script>fetch("/api/comments")</script></body>')
+        ) == 'inline data loader'
+
+    def test_verdict_remembered_per_template(self):
+        """Test that a template's verdict settles after agreeing pages"""
+        classifier = PageClassifier(min_samples=2)
+        assert classifier.template_key("https://example.com/blog/2023/one") == \
+            classifier.template_key("https://example.com/blog/2024/two")
+        assert classifier.remembered("https://example.com/app/a") is None
+        classifier.needs_browser("https://example.com/app/a", self.SPA)
+        classifier.needs_browser("https://example.com/app/b", self.SPA)
+        assert classifier.remembered("https://example.com/app/c") is True
+        assert classifier.needs_browser("https://example.com/app/c", self.ARTICLE) is True
+        assert classifier.remembered("https://example.com/docs/a") is None
+
+    def test_static_pages_skip_browser(self, temp_dir):
+        """Test that only dynamic pages are rendered"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, journal=False)
+        pages = {
+            "https://example.com/": self.ARTICLE,
+            "https://example.com/app": self.SPA,
+        }
+
+        def fake_get(url, **kwargs):
+            return build_response(url, 200, {'Content-Type': 'text/html'}, pages[url].encode(), 'utf-8')
+
+        driver = MagicMock(network_tracker_installed=True)
+        driver.page_source = self.ARTICLE
+        driver.execute_script.return_value = True
+        driver.get_log.return_value = []
+        archiver.driver_pool.factory = lambda: driver
+
+        with patch('requests.Session.get', side_effect=fake_get):
+            archiver._process_url("https://example.com/")
+            archiver._process_url("https://example.com/app")
+        driver.get.assert_called_once_with("https://example.com/app")
+        assert archiver.static_pages == 1
+        assert archiver.rendered_pages == 1
+        archiver.driver_pool.close()
+
+    def test_classified_page_streamed(self, temp_dir):
+        """Test that the classifier reads a prefix of a streamed page and the rest is rewritten as a stream"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, journal=False, stream_threshold_mb=1)
+        body = self.ARTICLE.replace('</body>', '<p>' + 'More text. ' * 150_000 + '</p><p>END</p></body>')
+
+        def fake_get(url, **kwargs):
+            response = requests.Response()
+            response.url = url
+            response.status_code = 200
+            response.headers = requests.structures.CaseInsensitiveDict({'Content-Type': 'text/html'})
+            response.encoding = 'utf-8'
+            response.raw = BytesIO(body.encode())
+            return response
+
+        with patch('requests.Session.get', side_effect=fake_get) as mock_get, \
+                patch.object(archiver.classifier, 'needs_browser', wraps=archiver.classifier.needs_browser) as classify, \
+                patch.object(archiver, '_parse_page', wraps=archiver._parse_page) as parse:
+            archiver._process_url("https://example.com/")
+
+        assert mock_get.call_args.kwargs['stream'] is True
+        assert len(classify.call_args.args[1]) <= PageClassifier.PREFIX_CHARS
+        parse.assert_not_called()
+        assert archiver.static_pages == 1 and archiver.rendered_pages == 0
+        saved = gzip.decompress((Path(temp_dir) / 'index.html.gz').read_bytes()).decode()
+        assert saved == body
+
+class TestResourceBlocking:
+    """Test suite for blocking resources in the rendering browser"""
+
+    def test_patterns_by_type_and_host(self):
+        """Test that types expand to URL patterns and hosts cover subdomains"""
+        patterns = blocked_url_patterns(['font'], ['tracker.example'])
+        assert '*.woff2' in patterns and '*.woff2?*' in patterns
+        assert '*://tracker.example/*' in patterns
+        assert '*://*.tracker.example/*' in patterns
+        assert not any('png' in p for p in patterns)
+        with pytest.raises(ValueError):
+            blocked_url_patterns(['video-games'])
+
+    def test_patterns_anchored_to_extension(self):
+        """Test that extensions only match at the end of the path"""
+        patterns = blocked_url_patterns(['image', 'media'])
+        matches = lambda url: any(fnmatch.fnmatchcase(url, p.replace('?', '[?]')) for p in patterns)
+        assert matches("https://example.com/logo.gif")
+        assert matches("https://example.com/logo.gif?v=2")
+        assert not matches("https://www.gifts.com/")
+        assert not matches("https://www.movies.com/main.js")
+        assert not matches("https://example.com/api/search?q=a.mp3&page=2")
+
+    def test_image_content_setting(self):
+        """Test that images are also blocked by type through Chrome preferences"""
+        assert blocked_content_settings(['image', 'font']) == {
+            'profile.managed_default_content_settings.images': 2
+        }
+        assert blocked_content_settings(['font']) == {}
+
+    def test_blocking_applied_over_cdp(self):
+        """Test that patterns reach Network.setBlockedURLs"""
+        driver = MagicMock()
+        assert block_resources(driver, ['*.png*']) is True
+        driver.execute_cdp_cmd.assert_called_with('Network.setBlockedURLs', {'urls': ['*.png*']})
+
+        driver = MagicMock()
+        assert block_resources(driver, []) is True
+        driver.execute_cdp_cmd.assert_not_called()
+
+        driver.execute_cdp_cmd.side_effect = Exception("not chrome")
+        assert block_resources(driver, ['*.png*']) is False
+
+    def test_new_browsers_block_configured_resources(self, temp_dir):
+        """Test that every pooled browser is created with the block list"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir,
+                                   block_resource_types=['image'], block_hosts=[])
+        with patch('archiver.core.webdriver.Chrome') as chrome:
+            driver = archiver._create_webdriver()
+        assert driver is chrome.return_value
+        driver.execute_cdp_cmd.assert_any_call(
+            'Network.setBlockedURLs', {'urls': blocked_url_patterns(['image'])}
+        )
+
+class TestParsedPage:
+    """Test suite for the single-walk parse"""
+
+    HTML = """
+    <html><head>
+        <link rel="stylesheet" href="/a.css"><link rel="shortcut icon" href="/f.ico">
+        <script src="/a.js"></script><script>inline()</script>
+    </head><body>
+        <img src="/a.jpg" srcset="/a-2x.jpg 2x"><a href="/next">Next</a><a name="top"></a>
+        <div style="background: url('/bg.png')"></div>
+    </body></html>
+    """
+
+    def test_targets_collected_in_one_walk(self):
+        """Test that every rewrite target is bucketed by type"""
+        page = ParsedPage.parse(self.HTML, resolve_parser())
+        assert [t['href'] for t in page.stylesheets] == ['/a.css']
+        assert [t['href'] for t in page.icons] == ['/f.ico']
+        assert [t['src'] for t in page.scripts] == ['/a.js']
+        assert [t['src'] for t in page.images] == ['/a.jpg']
+        assert [t['href'] for t in page.anchors] == ['/next']
+        assert len(page.styles) == 1
+
+    def test_parser_fallback(self):
+        """Test that lxml is preferred and a missing parser falls back"""
+        assert resolve_parser() == 'lxml'
+        assert resolve_parser('no-such-parser') == 'lxml'
+        assert resolve_parser('html.parser') == 'html.parser'
+
+    @patch('requests.Session.get')
+    def test_style_attribute_urls_embedded(self, mock_get, temp_dir, sample_image):
+        """Test that url() references in style attributes are inlined"""
+        mock_get.return_value = build_response(
+            "https://example.com/bg.png", 200, {'Content-Type': 'image/png'}, sample_image
+        )
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False)
+        result = archiver._process_html("https://example.com/", self.HTML)
+        assert 'url("data:image/png;base64,' in result
+        archiver._shutdown_asset_pool()
+
+class TestStreamingRewriter:
+    """Test suite for rewriting large pages as a token stream"""
+
+    HTML = (
+        '<!DOCTYPE html><html><head><link rel="stylesheet" href="/a.css"></head><body>'
+        '<!-- keep --><p class="x">Fish &amp; chips &#169;</p>'
+        '<script src="/a.js">ignored()</script><img src="/a.jpg" alt="A">'
+        '<a href="/next.html">Next</a>' + '<p>filler</p>' * 200 + '</body></html>'
+    )
+
+    def test_untouched_markup_copied_verbatim(self):
+        """Test that tags the rewrite ignores come out byte for byte"""
+        out = []
+        rewriter = StreamingRewriter(out.append, lambda name, attrs, raw: None, head_end='<meta x>')
+        for chunk in iter_chunks(self.HTML, 7):
+            rewriter.feed(chunk)
+        rewriter.close()
+        assert ''.join(out) == self.HTML.replace('</head>', '<meta x></head>')
+
+    @patch('requests.Session.get')
+    def test_large_page_streamed_to_gzip(self, mock_get, temp_dir, sample_image):
+        """Test that pages above the threshold are rewritten without a tree"""
+        assets = {
+            "https://example.com/a.css": (b"body { color: red; }", 'text/css'),
+            "https://example.com/a.js": (b"run();", 'application/javascript'),
+            "https://example.com/a.jpg": (sample_image, 'image/jpeg'),
+        }
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': assets[url][1]}, assets[url][0]
+        )
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False,
+                                   stream_threshold_mb=0.001, journal=False)
+        page = build_response("https://example.com/", 200, {'Content-Type': 'text/html'},
+                              self.HTML.encode(), 'utf-8')
+
+        with patch.object(archiver, '_parse_page', wraps=archiver._parse_page) as parse:
+            archiver._handle_response("https://example.com/", page)
+        parse.assert_not_called()
+
+        saved = gzip.decompress((Path(temp_dir) / 'index.html.gz').read_bytes()).decode()
+        assert '<style>body { color: red; }</style>' in saved
+        assert '<script>run();</script>' in saved and 'ignored()' not in saved
+        assert 'src="data:image/jpeg;base64,' in saved and 'alt="A"' in saved
+        assert '<a href="next.html">Next</a>' in saved
+        assert 'Fish &amp; chips &#169;' in saved and '<!-- keep -->' in saved
+        assert archiver.queue.get_nowait() == ("https://example.com/next.html", 1)
+
+    def test_small_pages_use_the_tree(self, temp_dir):
+        """Test that pages below the threshold keep the regular rewrite"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False)
+        page = build_response("https://example.com/", 200, {'Content-Type': 'text/html'},
+                              b'<html><body><p>small</p></body></html>', 'utf-8')
+        assert archiver._read_html(page) == '<html><body><p>small</p></body></html>'
+
+class TestProcessPool:
+    """Test suite for offloading CPU-bound stages to worker processes"""
+
+    def test_transcode_image(self, sample_image):
+        """Test that transcoding encodes and reports failures as text"""
+        data, content_type, quality, encodes, error = transcode_image(sample_image, 'image/jpeg', True, 500, 95)
+        assert (data, content_type) == (sample_image, 'image/jpeg')
+        assert quality is None and encodes == 0 and error is None
+
+        data, content_type, quality, encodes, error = transcode_image(b'not an image', 'image/png')
+        assert (data, content_type) == (b'not an image', 'image/png')
+        assert error.startswith('Error compressing image')
+
+    @patch('requests.Session.get')
+    def test_images_and_gzip_in_worker_processes(self, mock_get, temp_dir, sample_large_image):
+        """Test that the process pool produces the same output as the threads"""
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': 'image/jpeg'}, sample_large_image
+        )
+        inline = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, max_image_size_kb=50)
+        pooled = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, max_image_size_kb=50,
+                                 cpu_workers=2)
+        html = '<img src="/big.jpg">'
+        try:
+            assert pooled._process_html("https://example.com", html) == \
+                inline._process_html("https://example.com", html)
+            assert pooled._cpu_pool is not None
+
+            pooled._save_html_page("https://example.com/big.html", "x" * 200 * 1024)
+            saved = (Path(temp_dir) / 'big.html.gz').read_bytes()
+            assert gzip.decompress(saved) == b"x" * 200 * 1024
+        finally:
+            inline._shutdown_asset_pool()
+            pooled._shutdown_asset_pool()
+            pooled._shutdown_cpu_pool()
+        assert pooled._cpu_pool is None
+
+class TestImageCompression:
+    """Test suite for the JPEG quality search"""
+
+    @staticmethod
+    def _noisy_png(width, height, mode='RGB'):
+        img = Image.frombytes(mode, (width, height), os.urandom(width * height * len(mode)))
+        output = BytesIO()
+        img.save(output, 'PNG')
+        return output.getvalue()
+
+    def test_bisection_fits_with_few_encodes(self):
+        """Test that the highest fitting quality is found in a handful of encodes"""
+        data = self._noisy_png(800, 600)
+        compressed, quality, encodes = compress_image_data(data, max_size_kb=200, quality=95)
+        assert len(compressed) <= 200 * 1024
+        assert Image.open(BytesIO(compressed)).format == 'JPEG'
+        # A linear search would need one encode per 5 quality steps
+        assert encodes <= 8
+        if quality < 93:
+            # Within the search precision of the best quality that fits
+            above = BytesIO()
+            Image.open(BytesIO(data)).save(above, 'JPEG', quality=quality + 3, optimize=True, progressive=True)
+            assert above.tell() > 200 * 1024
+
+    def test_lowest_quality_when_nothing_fits(self):
+        """Test that an image too big for any quality gets the smallest encode"""
+        data = self._noisy_png(400, 400, 'RGBA')
+        compressed, quality, encodes = compress_image_data(data, max_size_kb=1)
+        assert quality == 30
+        assert Image.open(BytesIO(compressed)).mode == 'RGB'
+        assert encodes <= 8
+
+    def test_page_images_logged_with_encodes(self, temp_dir):
+        """Test that each image recompressed by a page rewrite logs its quality and encodes"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False,
+                                   image_cache_mb=0, max_image_size_kb=50, image_formats=('jpeg',))
+        data = self._noisy_png(400, 300)
+        archiver.fetch = lambda url, **kwargs: build_response(url, 200, {'Content-Type': 'image/png'}, data)
+        with patch.object(archiver.logger, 'info') as info:
+            archiver._process_html("https://example.com/", '<img src="/noise.png">')
+        archiver._shutdown_asset_pool()
+        messages = [call.args[0] for call in info.call_args_list]
+        assert any("as image/jpeg (quality=" in m and " encodes)" in m for m in messages)
+        assert archiver.images_compressed == 1
+
+    def test_small_images_untouched(self, sample_image):
+        """Test that images under the limit are returned as they are"""
+        assert compress_image_data(sample_image, max_size_kb=500) == (sample_image, None, 0)
+
+    def test_downscaled_to_display_size(self):
+        """Test that an image larger than its display size is scaled down"""
+        photo = BytesIO()
+        Image.new('RGB', (3000, 2000), 'green').save(photo, 'PNG')
+        data, content_type, _, _ = optimize_image(photo.getvalue(), max_width=600, formats=('jpeg',))
+        assert content_type == 'image/jpeg'
+        assert Image.open(BytesIO(data)).size == (600, 400)
+
+    def test_smallest_format_keeps_transparency(self):
+        """Test that transparent images only use formats with alpha"""
+        data = self._noisy_png(300, 300, 'RGBA')
+        webp, content_type, _, _ = optimize_image(data, max_size_kb=1000, max_width=200,
+                                                  formats=('webp', 'jpeg'))
+        assert content_type == 'image/webp'
+        assert Image.open(BytesIO(webp)).mode == 'RGBA'
+
+        flat, content_type, _, _ = optimize_image(data, max_size_kb=1000, max_width=200, formats=('jpeg',))
+        assert content_type == 'image/jpeg'
+        assert Image.open(BytesIO(flat)).mode == 'RGB'
+
+    def test_display_size_hints(self, temp_dir):
+        """Test that width/height attributes, CSS and sizes bound the rendered size"""
+        archiver = WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, image_dpr=2)
+        def size(markup):
+            return archiver._display_size(BeautifulSoup(markup, 'html.parser').img)
+        assert size('<img width="300" height="200">') == (600, 400)
+        assert size('<img width="300" style="max-width: 150px">') == (300, None)
+        assert size('<img width="100%">') == (None, None)
+        assert size('<img sizes="(max-width: 600px) 480px, 800px">') == (1600, None)
+        assert size('<img sizes="(max-width: 600px) 100vw, 800px">') == (None, None)
+        archiver.downscale_images = False
+        assert size('<img width="300">') == (None, None)
+
+class TestImageCache:
+    """Test suite for the persistent transcoded-image cache"""
+
+    def test_round_trip_and_reopen(self, temp_dir):
+        """Test that entries survive closing and reopening the cache"""
+        directory = os.path.join(temp_dir, "images")
+        key = ImageCache.make_key(b"source", 500, 95)
+        assert key != ImageCache.make_key(b"source", 500, 80)
+        assert key != ImageCache.make_key(b"other", 500, 95)
+
+        cache = ImageCache(directory)
+        assert cache.get(key) is None
+        cache.put(key, b"encoded", "image/webp")
+        cache.close()
+
+        cache = ImageCache(directory)
+        assert cache.get(key) == (b"encoded", "image/webp")
+        assert cache.current_bytes == len(b"encoded")
+        assert (cache.hits, cache.misses) == (1, 0)
+        cache.close()
+
+    def test_entries_without_content_type_are_misses(self, temp_dir):
+        """Test that an index from before content types were stored is upgraded"""
+        import sqlite3
+        conn = sqlite3.connect(os.path.join(temp_dir, "index.sqlite3"))
+        conn.execute("CREATE TABLE blobs (key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        conn.execute("INSERT INTO blobs VALUES ('aa-1', 4, 0)")
+        conn.commit()
+        conn.close()
+
+        cache = ImageCache(temp_dir)
+        assert cache.get("aa-1") is None
+        assert len(cache) == 0
+        cache.put("aa-1", b"webp", "image/webp")
+        assert cache.get("aa-1") == (b"webp", "image/webp")
+        cache.close()
+
+    def test_size_based_eviction(self, temp_dir):
+        """Test that least recently used blobs are evicted to fit"""
+        cache = ImageCache(temp_dir, max_bytes=25)
+        cache.put("aa-1", b"x" * 10, "image/jpeg")
+        cache.put("bb-2", b"x" * 10, "image/jpeg")
+        assert cache.get("aa-1") is not None
+        cache.put("cc-3", b"x" * 10, "image/jpeg")
+        assert cache.get("bb-2") is None
+        assert cache.get("aa-1") is not None
+        assert cache.current_bytes == 20
+        assert not os.path.exists(os.path.join(temp_dir, "bb", "bb-2"))
+        cache.close()
+
+    @patch('requests.Session.get')
+    def test_unchanged_images_not_reencoded_across_runs(self, mock_get, temp_dir, cache_home, sample_large_image):
+        """Test that a run into a fresh output directory reuses an earlier run's transcoded images"""
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': 'image/jpeg'}, sample_large_image
+        )
+        html = '<img src="/big.jpg" width="500">'
+        outputs = []
+        for run in range(2):
+            archiver = WebsiteArchiver("https://example.com", os.path.join(temp_dir, f"run{run}"),
+                                       wait_for_ajax=False, asset_workers=1, max_image_size_kb=50)
+            with patch('archiver.core.transcode_image', wraps=transcode_image) as transcode:
+                outputs.append(archiver._process_html("https://example.com/", html))
+            archiver._close_image_cache()
+            calls = transcode.call_count
+        assert calls == 0
+        assert outputs[0] == outputs[1]
+        assert os.path.exists(cache_home / "website-archiver" / "images" / "index.sqlite3")
+        assert not os.path.exists(os.path.join(temp_dir, "run0", ".image_cache"))
+
+class TestResponsiveImages:
+    """Test suite for srcset, <picture> and lazy-load resolution"""
+
+    @pytest.fixture
+    def responsive_archiver(self, temp_dir):
+        return WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, image_dpr=2)
+
+    @staticmethod
+    def _img(archiver, markup):
+        page = archiver._parse_page(markup)
+        return page.images[0], page
+
+    def test_parse_srcset(self):
+        """Test width and density descriptors"""
+        assert parse_srcset("a.jpg 480w, b.jpg 960w") == [("a.jpg", 480, None), ("b.jpg", 960, None)]
+        assert parse_srcset("a.jpg, b.jpg 2x, c.jpg bogus") == [("a.jpg", None, 1.0), ("b.jpg", None, 2.0)]
+
+    def test_parse_srcset_commas_in_urls(self):
+        """Test that commas inside candidate URLs are kept, as in CDN transformation paths"""
+        base = "https://res.cloudinary.com/demo/image/upload"
+        assert parse_srcset(f"{base}/w_480,c_fill/a.jpg 480w,{base}/w_960,c_fill/a.jpg 960w") == [
+            (f"{base}/w_480,c_fill/a.jpg", 480, None),
+            (f"{base}/w_960,c_fill/a.jpg", 960, None),
+        ]
+
+    def test_cdn_candidate_chosen(self, responsive_archiver):
+        """Test that a Cloudinary-style srcset yields a complete candidate URL"""
+        base = "https://res.cloudinary.com/demo/image/upload"
+        img, _ = self._img(responsive_archiver,
+                           f'<img src="{base}/a.jpg" srcset="{base}/w_480,c_fill/a.jpg 480w, '
+                           f'{base}/w_960,c_fill/a.jpg 960w" width="300">')
+        assert img['src'] == f"{base}/w_960,c_fill/a.jpg"
+
+    def test_unusable_candidate_keeps_src(self, responsive_archiver):
+        """Test that the original src survives a candidate that cannot be loaded"""
+        img, _ = self._img(responsive_archiver, '<img src="a.jpg" srcset="javascript:void(0) 1x">')
+        assert img['src'] == 'a.jpg'
+
+    def test_width_candidate_for_rendered_size(self, responsive_archiver):
+        """Test that the smallest candidate covering the display size wins"""
+        img, _ = self._img(responsive_archiver,
+                           '<img src="s.jpg" srcset="s.jpg 320w, m.jpg 640w, l.jpg 1280w, xl.jpg 2560w" width="300">')
+        assert img['src'] == 'm.jpg'
+        assert 'srcset' not in img.attrs
+
+        img, _ = self._img(responsive_archiver, '<img srcset="s.jpg 320w, l.jpg 1280w">')
+        assert img['src'] == 'l.jpg'
+
+    def test_density_candidate(self, responsive_archiver):
+        """Test that x descriptors follow the configured pixel ratio"""
+        img, _ = self._img(responsive_archiver, '<img src="a.jpg" srcset="a.jpg 1x, b.jpg 2x, c.jpg 3x">')
+        assert img['src'] == 'b.jpg'
+
+    def test_lazy_attributes(self, responsive_archiver):
+        """Test that lazy-load attributes replace the placeholder"""
+        img, _ = self._img(responsive_archiver,
+                           '<img src="data:image/gif;base64,R0lGOD" data-src="real.jpg" class="lazyload">')
+        assert img['src'] == 'real.jpg'
+        assert 'data-src' not in img.attrs
+
+        img, _ = self._img(responsive_archiver,
+                           '<img src="blank.gif" data-srcset="a.jpg 1x, b.jpg 2x">')
+        assert img['src'] == 'b.jpg'
+
+    def test_picture_sources(self, responsive_archiver):
+        """Test that the first matching source is used and every source dropped"""
+        img, page = self._img(responsive_archiver, """
+            <picture>
+                <source type="image/jxl" srcset="a.jxl">
+                <source media="(max-width: 600px)" srcset="mobile.webp">
+                <source media="(min-width: 1000px)" type="image/webp" srcset="desk-1x.webp 1x, desk-2x.webp 2x">
+                <img src="fallback.jpg">
+            </picture>
+        """)
+        assert img['src'] == 'desk-2x.webp'
+        assert page.soup.find('source') is None
+
+    @patch('requests.Session.get')
+    def test_only_chosen_candidate_fetched(self, mock_get, responsive_archiver, sample_image):
+        """Test that exactly one variant per image is downloaded and inlined"""
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': 'image/jpeg'}, sample_image
+        )
+        result = responsive_archiver._process_html(
+            "https://example.com/",
+            '<img src="/s.jpg" srcset="/s.jpg 320w, /l.jpg 1280w" sizes="600px">'
+        )
+        assert [call.args[0] for call in mock_get.call_args_list] == ["https://example.com/l.jpg"]
+        assert 'srcset' not in result and 'data:image/' in result
+        responsive_archiver._shutdown_asset_pool()
+
+class TestExternalAssets:
+    """Test suite for the content-addressed external asset mode"""
+
+    @pytest.fixture
+    def external_archiver(self, temp_dir):
+        return WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False,
+                               compress_images=False, asset_mode="external")
+
+    def test_asset_store_deduplicates(self, temp_dir):
+        """Test that identical bodies are written once under their digest"""
+        store = AssetStore(temp_dir)
+        first = store.store(b"body", "image/png", "https://example.com/a.png")
+        second = store.store(b"body", "image/png", "https://example.com/copy/b.png")
+        assert first == second
+        assert first.startswith("assets/") and first.endswith(".png")
+        assert (store.written, store.reused) == (1, 1)
+        with open(os.path.join(temp_dir, first), "rb") as f:
+            assert f.read() == b"body"
+
+    def test_asset_extension(self):
+        """Test extensions from the content type, then the URL"""
+        assert asset_extension("image/webp") == ".webp"
+        assert asset_extension("text/css; charset=utf-8") == ".css"
+        assert asset_extension("", "https://example.com/font.woff2") == ".woff2"
+        assert asset_extension(None) == ".bin"
+
+    def test_unknown_asset_mode(self, temp_dir):
+        """Test that an unknown asset mode is rejected"""
+        with pytest.raises(ValueError):
+            WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, asset_mode="zip")
+
+    @patch('requests.Session.get')
+    def test_pages_reference_shared_files(self, mock_get, external_archiver, sample_image):
+        """Test that assets are written once and linked relative to each page"""
+        bodies = {
+            "https://example.com/logo.jpg": ("image/jpeg", sample_image),
+            "https://example.com/bg.jpg": ("image/jpeg", b"background"),
+            "https://example.com/style.css": ("text/css", b"body { background: url('bg.jpg'); }"),
+            "https://example.com/app.js": ("application/javascript", b"console.log(1);"),
+        }
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': bodies[url][0]}, bodies[url][1]
+        )
+        markup = """
+            <html><head>
+                <link rel="stylesheet" href="/style.css">
+                <script src="/app.js"></script>
+            </head><body><img src="/logo.jpg"></body></html>
+        """
+        home = BeautifulSoup(external_archiver._process_html("https://example.com/", markup), 'html.parser')
+        post = BeautifulSoup(external_archiver._process_html("https://example.com/blog/post", markup), 'html.parser')
+
+        assert 'data:' not in str(home) + str(post)
+        assert home.find('img')['src'].startswith('assets/')
+        assert post.find('img')['src'] == '../../' + home.find('img')['src']
+        assert post.find('script')['src'] == '../../' + home.find('script')['src']
+        stylesheet = post.find('link', rel='stylesheet')['href']
+        assert stylesheet.startswith('../../assets/') and stylesheet.endswith('.css')
+
+        # url() inside the stylesheet points at a file in the same directory
+        with open(os.path.join(external_archiver.output_dir, stylesheet[len('../../'):])) as f:
+            css = f.read()
+        background = css.split('url("')[1].split('"')[0]
+        assert '/' not in background
+        assert os.path.exists(os.path.join(external_archiver.output_dir, 'assets', background))
+
+        assert len(os.listdir(os.path.join(external_archiver.output_dir, 'assets'))) == 4
+        assert len(mock_get.call_args_list) == 4
+        external_archiver._shutdown_asset_pool()
+
+class TestWarcOutput:
+    """Test suite for the WARC/WACZ writer"""
+
+    @staticmethod
+    def _read_index(writer):
+        with open(writer.index_path) as f:
+            return [json.loads(line.split(' ', 2)[2]) for line in f]
+
+    def test_surt(self):
+        """Test the CDX key of a URL"""
+        assert surt("https://www.Example.com/Path?b=2&a=1") == "com,example)/path?a=1&b=2"
+        assert surt("http://example.com:8080") == "com,example:8080)/"
+
+    def test_records_readable_from_index(self, temp_dir):
+        """Test that each indexed record is a gzip member holding the exchange"""
+        writer = WarcWriter(temp_dir)
+        assert writer.write_exchange(
+            "https://example.com/page", 200,
+            {'Content-Type': 'text/html', 'Content-Encoding': 'gzip'}, b"<p>hello</p>",
+            request_headers={'User-Agent': 'test'}
+        )
+        assert not writer.write_exchange("https://example.com/page", 200, {}, b"again")
+        writer.close()
+
+        entry, = self._read_index(writer)
+        assert entry['status'] == '200' and entry['mime'] == 'text/html'
+        with open(os.path.join(temp_dir, entry['filename']), 'rb') as f:
+            f.seek(int(entry['offset']))
+            record = gzip.decompress(f.read(int(entry['length'])))
+        assert record.startswith(b"WARC/1.1\r\nWARC-Type: response")
+        assert b"HTTP/1.1 200 OK\r\n" in record
+        assert b"Content-Encoding" not in record
+        assert record.endswith(b"Content-Length: 12\r\n\r\n<p>hello</p>\r\n\r\n")
+
+    def test_rotation(self, temp_dir):
+        """Test that a new file is started at the size limit"""
+        writer = WarcWriter(temp_dir, max_size=1)
+        for n in range(3):
+            writer.write_exchange(f"https://example.com/{n}", 200, {'Content-Type': 'text/plain'}, b"x")
+        writer.close()
+        assert len(writer.warc_paths) == 3
+        assert len({entry['filename'] for entry in self._read_index(writer)}) == 3
+
+    def test_package_wacz(self, temp_dir):
+        """Test the layout and datapackage of a WACZ"""
+        writer = WarcWriter(os.path.join(temp_dir, "warc"))
+        writer.write_exchange("https://example.com/b", 200, {'Content-Type': 'text/html'}, b"b")
+        writer.write_exchange("https://example.com/a", 200, {'Content-Type': 'image/png'}, b"a")
+        path = writer.package_wacz(os.path.join(temp_dir, "site.wacz"))
+
+        with zipfile.ZipFile(path) as wacz:
+            names = wacz.namelist()
+            index = wacz.read("indexes/index.cdxj").decode().splitlines()
+            pages = wacz.read("pages/pages.jsonl").decode().splitlines()
+            datapackage = json.loads(wacz.read("datapackage.json"))
+            warc_name = next(name for name in names if name.startswith("archive/"))
+            warc_bytes = wacz.read(warc_name)
+        assert {"indexes/index.cdxj", "pages/pages.jsonl", "datapackage.json"} <= set(names)
+        assert [line.split()[0] for line in index] == ["com,example)/a", "com,example)/b"]
+        assert len(pages) == 2 and json.loads(pages[1])['url'] == "https://example.com/b"
+        resource = next(r for r in datapackage['resources'] if r['path'] == warc_name)
+        assert resource['hash'] == "sha256:" + hashlib.sha256(warc_bytes).hexdigest()
+
+    def test_unknown_output_format(self, temp_dir):
+        """Test that an unknown output format is rejected"""
+        with pytest.raises(ValueError):
+            WebsiteArchiver("https://example.com", temp_dir, wait_for_ajax=False, output_format="tar")
+
+    @patch('requests.Session.get')
+    def test_archiver_records_instead_of_files(self, mock_get, temp_dir, sample_image):
+        """Test that pages and assets go to the WACZ and no loose files are written"""
+        bodies = {
+            "https://example.com/": ("text/html", b'<html><body><img src="/logo.jpg"></body></html>'),
+            "https://example.com/logo.jpg": ("image/jpeg", sample_image),
+        }
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': bodies[url][0]}, bodies[url][1]
+        )
+        archiver = WebsiteArchiver("https://example.com/", temp_dir, wait_for_ajax=False,
+                                   output_format="wacz", journal=False)
+        archiver._process_url("https://example.com/")
+        archiver._close_warc()
+        archiver._shutdown_asset_pool()
+
+        assert not os.path.exists(os.path.join(temp_dir, "index.html"))
+        with zipfile.ZipFile(os.path.join(temp_dir, "archive.wacz")) as wacz:
+            urls = [json.loads(line.split(' ', 2)[2])['url']
+                    for line in wacz.read("indexes/index.cdxj").decode().splitlines()]
+        assert sorted(urls) == ["https://example.com/", "https://example.com/logo.jpg"]
+
+    @patch('requests.Session.get')
+    def test_assets_recorded_without_embedding(self, mock_get, temp_dir, sample_image):
+        """Test that WARC output fetches assets for their records and leaves tags alone"""
+        bodies = {
+            "https://example.com/logo.jpg": ("image/jpeg", sample_image),
+            "https://example.com/style.css": ("text/css", b"body { background: url('bg.png'); }"),
+            "https://example.com/bg.png": ("image/png", b"png"),
+            "https://example.com/hero.png": ("image/png", b"hero"),
+            "https://example.com/favicon.ico": ("image/x-icon", b"ico"),
+        }
+        mock_get.side_effect = lambda url, **kwargs: build_response(
+            url, 200, {'Content-Type': bodies[url][0]}, bodies[url][1]
+        )
+        markup = """<html><head><link rel="stylesheet" href="/style.css"><link rel="icon" href="/favicon.ico">
+            </head><body><img src="/logo.jpg"><div style="background: url(/hero.png)"></div></body></html>"""
+        for asset_workers in (8, 1):
+            archiver = WebsiteArchiver("https://example.com/", os.path.join(temp_dir, str(asset_workers)),
+                                       wait_for_ajax=False, output_format="warc", journal=False,
+                                       asset_workers=asset_workers)
+            result = archiver._process_html("https://example.com/", markup)
+            archiver._shutdown_asset_pool()
+            writer = archiver.warc_writer
+            archiver._close_warc()
+
+            assert 'data:' not in result and '<style>' not in result
+            assert 'src="/logo.jpg"' in result and 'href="/style.css"' in result
+            assert 'url(/hero.png)' in result
+            assert len(archiver.asset_cache) == 0
+            assert sorted(entry['url'] for entry in self._read_index(writer)) == sorted(bodies)
+
+class TestFetcher:
+    """Test suite for the pooled HTTP client"""
+
+    def test_session_reused(self):
+        """Test that the fetcher keeps one keep-alive session"""
+        fetcher = Fetcher(pool_connections=4, pool_maxsize=8)
+        assert fetcher.session is fetcher.session
+        adapter = fetcher.session.get_adapter("https://example.com")
+        assert adapter._pool_connections == 4
+        assert adapter._pool_maxsize == 8
+
+    def test_session_shared_between_threads(self):
+        """Test that every thread draws on the same connection pools"""
+        import threading
+        fetcher = Fetcher()
+        sessions = []
+        t = threading.Thread(target=lambda: sessions.append(fetcher.session))
+        t.start()
+        t.join()
+        assert sessions[0] is fetcher.session
+        fetcher.close()
+        assert fetcher._session is None
+
+    @patch('requests.Session.get')
+    def test_archiver_fetch_uses_pool(self, mock_get, archiver):
+        """Test that archiver downloads go through the fetcher"""
+        mock_get.return_value = Mock(status_code=200, ok=True)
+        archiver.fetch("https://example.com/a.css")
+        mock_get.assert_called_once_with("https://example.com/a.css", timeout=30)
+
+class TestSingleFlight:
+    """Test suite for in-flight fetch deduplication"""
+
+    def _run_concurrently(self, count, target):
+        import threading
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def test_concurrent_calls_share_result(self):
+        """Test that concurrent callers for one key run the function once"""
+        import time
+        flight = SingleFlight()
+        calls = []
+        results = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return "body"
+
+        self._run_concurrently(5, lambda: results.append(flight.do("k", slow)))
+        assert calls == [1]
+        assert results == ["body"] * 5
+        assert flight.shared == 4
+        assert flight.do("k", lambda: "again") == "again"
+
+    def test_errors_shared_with_waiters(self):
+        """Test that every waiting caller sees the leader's exception"""
+        import time
+        flight = SingleFlight()
+        errors = []
+
+        def fail():
+            time.sleep(0.2)
+            raise requests.ConnectionError("down")
+
+        def call():
+            try:
+                flight.do("k", fail)
+            except requests.ConnectionError as e:
+                errors.append(e)
+
+        self._run_concurrently(3, call)
+        assert len(errors) == 3
+
+    @patch('requests.Session.get')
+    def test_archiver_fetch_deduplicates(self, mock_get, archiver):
+        """Test that worker threads fetching one asset trigger one download"""
+        import time
+
+        def get(url, **kwargs):
+            time.sleep(0.2)
+            return build_response(url, 200, {}, b'x')
+        mock_get.side_effect = get
+
+        self._run_concurrently(4, lambda: archiver.fetch("https://example.com/logo.png"))
+        assert mock_get.call_count == 1
+
+class TestHostScheduler:
+    """Test suite for per-host politeness and adaptive concurrency"""
+
+    def test_rate_cap(self):
+        """Test that requests to one host are spaced by the rate cap"""
+        import time
+        scheduler = HostScheduler(max_rps=20)
+        start = time.monotonic()
+        for _ in range(5):
+            scheduler.acquire("example.com")
+            scheduler.release("example.com", 200, 0.01)
+        assert time.monotonic() - start >= 4 / 20
+        # Other hosts are not affected
+        scheduler.acquire("other.com")
+
+    def test_aimd_concurrency(self):
+        """Test multiplicative decrease on throttling and additive recovery"""
+        scheduler = HostScheduler(max_concurrency=8, decrease_cooldown=0)
+        assert scheduler.limit("example.com") == 8
+        scheduler.acquire("example.com")
+        scheduler.release("example.com", 429, 0.1)
+        assert scheduler.limit("example.com") == 4
+        scheduler.acquire("example.com")
+        scheduler.release("example.com", error=True)
+        assert scheduler.limit("example.com") == 2
+        for _ in range(10):
+            scheduler.acquire("example.com")
+            scheduler.release("example.com", 200, 0.1)
+        assert 2 < scheduler.limit("example.com") <= 8
+
+    def test_latency_target(self):
+        """Test that slow responses lower the concurrency limit"""
+        scheduler = HostScheduler(max_concurrency=8, latency_target=0.5)
+        scheduler.acquire("example.com")
+        scheduler.release("example.com", 200, 2.0)
+        assert scheduler.limit("example.com") == 4
+
+    def test_concurrency_limit_blocks(self):
+        """Test that a host at its limit makes further callers wait for a release"""
+        import threading
+        import time
+        scheduler = HostScheduler(max_concurrency=1)
+        scheduler.acquire("example.com")
+        acquired = threading.Event()
+        t = threading.Thread(target=lambda: (scheduler.acquire("example.com"), acquired.set()))
+        t.start()
+        time.sleep(0.1)
+        assert not acquired.is_set()
+        scheduler.release("example.com", 200, 0.01)
+        t.join(timeout=2)
+        assert acquired.is_set()
+
+    def test_parse_retry_after(self):
+        """Test Retry-After in seconds and HTTP date form"""
+        from email.utils import formatdate
+        import time
+        assert parse_retry_after("3") == 3.0
+        assert 8 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("soon") is None
+
+    @patch('requests.Session.get')
+    def test_fetch_honours_retry_after(self, mock_get, archiver):
+        """Test that a 429 blocks the host for Retry-After and is retried"""
+        import time
+        mock_get.side_effect = [
+            build_response("https://example.com/a", 429, {'Retry-After': '1'}, b''),
+            build_response("https://example.com/a", 200, {}, b'ok'),
+        ]
+        start = time.monotonic()
+        response = archiver.fetch("https://example.com/a")
+        assert response.status_code == 200
+        assert mock_get.call_count == 2
+        assert time.monotonic() - start >= 0.9
+
+    def test_backoff_without_retry_after(self):
+        """Test that throttling without Retry-After blocks the host exponentially longer"""
+        scheduler = HostScheduler(retry_backoff=0.5, max_retry_backoff=1.5)
+        for attempt, expected in ((0, 0.5), (1, 1.0), (3, 1.5)):
+            scheduler.acquire("example.com")
+            scheduler.release("example.com", 503, 0.01, attempt=attempt)
+            with scheduler._cond:
+                wait = scheduler._try_acquire("example.com")
+            assert expected - 0.1 <= wait <= expected
+            scheduler._state("example.com").blocked_until = 0
+
+    @patch('requests.Session.get')
+    def test_long_retry_after_capped_and_failed(self, mock_get, archiver):
+        """Test that a Retry-After beyond the cap fails the URL and blocks the host only up to the cap"""
+        mock_get.return_value = build_response("https://example.com/a", 429, {'Retry-After': '86400'}, b'')
+        with patch.object(archiver.logger, 'warning') as warning:
+            assert archiver.fetch("https://example.com/a").status_code == 429
+        assert mock_get.call_count == 1
+        assert 'exceeds the 60s cap' in warning.call_args.args[0]
+        with archiver.scheduler._cond:
+            wait = archiver.scheduler._try_acquire("example.com")
+        assert 59 <= wait <= 60
+
+    @patch('requests.Session.get')
+    def test_throttled_response_closed_before_retry(self, mock_get, archiver):
+        """Test that a discarded 429 is closed and the retry waits for the backoff"""
+        import time
+        archiver.scheduler.retry_backoff = 0.3
+        throttled = build_response("https://example.com/a", 429, {}, b'')
+        throttled.close = MagicMock()
+        mock_get.side_effect = [throttled, build_response("https://example.com/a", 200, {}, b'ok')]
+        start = time.monotonic()
+        assert archiver.fetch("https://example.com/a", stream=True).status_code == 200
+        assert time.monotonic() - start >= 0.25
+        throttled.close.assert_called_once()
+
+class TestConcurrentAssets:
+    """Test suite for concurrent asset resolution within a page"""
+
+    def _slow_get(self, sample_image, delay):
+        import time
+
+        def get(url, **kwargs):
+            time.sleep(delay)
+            return build_response(url, 200, {'content-type': 'image/jpeg'}, sample_image)
+        return get
+
+    @patch('requests.Session.get')
+    def test_assets_fetched_concurrently(self, mock_get, archiver, sample_image):
+        """Test that page latency approaches the slowest asset, not the sum"""
+        import time
+        mock_get.side_effect = self._slow_get(sample_image, 0.2)
+        html = "".join(f'<img src="/img{i}.jpg">' for i in range(6))
+
+        start = time.time()
+        result = archiver._process_html("https://example.com", html)
+        elapsed = time.time() - start
+
+        assert mock_get.call_count == 6
+        assert result.count('data:image/jpeg;base64,') == 6
+        assert elapsed < 0.2 * 6 / 2
+        archiver._shutdown_asset_pool()
+
+    @patch('requests.Session.get')
+    def test_sequential_mode(self, mock_get, temp_dir, sample_image):
+        """Test that asset_workers=1 keeps the sequential rewrite"""
+        mock_get.side_effect = self._slow_get(sample_image, 0)
+        archiver = WebsiteArchiver("https://example.com", temp_dir,
+                                   wait_for_ajax=False, asset_workers=1)
+        result = archiver._process_html("https://example.com", '<img src="/a.jpg">')
+        assert 'data:image/jpeg;base64,' in result
+        assert archiver._asset_pool is None
+
+    @patch('requests.Session.get')
+    def test_failed_prefetch_not_refetched(self, mock_get, archiver):
+        """Test that a failed prefetch is reported once without a second download"""
+        mock_get.side_effect = requests.ConnectionError("boom")
+        result = archiver._process_html("https://example.com", '<img src="/a.jpg">')
+        assert mock_get.call_count == 1
+        assert 'src="/a.jpg"' in result
+        archiver._shutdown_asset_pool()
+
+class TestAssetCache:
+    """Test suite for the cross-page asset cache"""
+
+    def test_lru_eviction_by_size(self):
+        """Test that least recently used entries are evicted to fit the byte budget"""
+        cache = AssetCache(max_bytes=10)
+        cache.put('a', 'xxxx')
+        cache.put('b', 'yyyy')
+        assert cache.get('a') == 'xxxx'
+        cache.put('c', 'zzzz')
+        assert cache.get('b') is None
+        assert cache.get('a') == 'xxxx'
+        assert cache.get('c') == 'zzzz'
+        assert cache.current_bytes == 8
+
+    def test_oversized_value_not_cached(self):
+        """Test that a value larger than the whole budget is skipped"""
+        cache = AssetCache(max_bytes=3)
+        cache.put('a', 'xxxx')
+        assert len(cache) == 0
+        assert cache.current_bytes == 0
+
+    @patch('requests.Session.get')
+    def test_shared_assets_processed_once(self, mock_get, archiver, sample_image):
+        """Test that assets shared by several pages are downloaded and encoded once"""
+        def get(url, **kwargs):
+            if url.endswith('.css'):
+                return build_response(url, 200, {'content-type': 'text/css'},
+                                      b'body { background: url(bg.jpg); }')
+            return build_response(url, 200, {'content-type': 'image/jpeg'}, sample_image)
+        mock_get.side_effect = get
+        html = '<link rel="stylesheet" href="/css/site.css"><img src="/logo.jpg">'
+
+        with patch('archiver.core.transcode_image', wraps=transcode_image) as compress:
+            first = archiver._process_html("https://example.com/a.html", html)
+            second = archiver._process_html("https://example.com/b/c.html", html)
+
+        fetched = sorted(call.args[0] for call in mock_get.call_args_list)
+        assert fetched == [
+            "https://example.com/css/bg.jpg",
+            "https://example.com/css/site.css",
+            "https://example.com/logo.jpg",
+        ]
+        assert compress.call_count == 1
+        assert first == second
+        archiver._shutdown_asset_pool()
+
+class RouteHandler(http.server.BaseHTTPRequestHandler):
+    """Serve scripted responses per path: (status, headers, body, delay), the last one repeating"""
+
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        responses = self.server.routes[self.path]
+        status, headers, body, delay = responses.pop(0) if len(responses) > 1 else responses[0]
+        time.sleep(delay)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestAsyncWebsiteArchiver:
+    """Test suite for the asyncio crawl engine"""
+
+    @pytest.fixture
+    def async_archiver(self, temp_dir):
+        return AsyncWebsiteArchiver(
+            base_url="https://example.com",
+            output_dir=temp_dir,
+            compress_images=False,
+            wait_for_ajax=False,
+            max_concurrency=10
+        )
+
+    @pytest.fixture
+    def local_server(self):
+        """Threaded HTTP server on a free local port"""
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RouteHandler)
+        server.routes = {}
+        server.hits = []
+        server.url = f"http://127.0.0.1:{server.server_address[1]}"
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def test_concurrent_fetches_share_download(self, local_server, temp_dir):
+        """Test that concurrent fetches of one URL make a single request"""
+        local_server.routes['/slow.css'] = [(200, {'Content-Type': 'text/css'}, b'body {}', 0.3)]
+        archiver = AsyncWebsiteArchiver(local_server.url, temp_dir, wait_for_ajax=False, journal=False)
+        url = f"{local_server.url}/slow.css"
+
+        async def fetch_together():
+            archiver._request_semaphore = asyncio.Semaphore(10)
+            async with aiohttp.ClientSession() as session:
+                archiver._session = session
+                return await asyncio.gather(*(archiver.fetch_async(url) for _ in range(5)))
+
+        results = asyncio.run(fetch_together())
+        assert local_server.hits == ['/slow.css']
+        assert [r.content for r in results] == [b'body {}'] * 5
+        assert archiver._single_flight.shared == 4
+        assert archiver._inflight == {}
+
+    def test_throttled_page_retried(self, local_server, temp_dir):
+        """Test that a 429 is retried after the host backs off and the page is archived"""
+        local_server.routes['/'] = [
+            (429, {'Retry-After': '0'}, b'slow down', 0),
+            (200, {'Content-Type': 'text/html'}, b'<html><body>archived</body></html>', 0),
+        ]
+        archiver = AsyncWebsiteArchiver(local_server.url, temp_dir, wait_for_ajax=False, journal=False)
+        archiver.scheduler.retry_backoff = 0.05
+
+        with patch.object(archiver.scheduler, 'acquire_async', wraps=archiver.scheduler.acquire_async) as acquire:
+            assert archiver.start_archive() is True
+        assert local_server.hits == ['/', '/']
+        assert acquire.call_count == 2
+        with open(os.path.join(temp_dir, "index.html")) as f:
+            assert 'archived' in f.read()
+
+    def test_crawl_inlines_prefetched_assets(self, async_archiver, sample_image):
+        """Test that page assets are fetched on the loop and reused by the rewrite"""
+        pages = {
+            "https://example.com/": (
+                'text/html',
+                b'<html><head><link rel="stylesheet" href="/s.css"></head>'
+                b'<body><img src="/i.jpg"></body></html>'
+            ),
+            "https://example.com/s.css": ('text/css', b'body { background: url(/bg.jpg); }'),
+            "https://example.com/i.jpg": ('image/jpeg', sample_image),
+            "https://example.com/bg.jpg": ('image/jpeg', sample_image),
+        }
+        fetched = []
+
+        async def fake_fetch(url):
+            fetched.append(url)
+            content_type, body = pages[url]
+            return build_response(url, 200, {'content-type': content_type}, body, 'utf-8')
+
+        with patch.object(async_archiver, 'fetch_async', side_effect=fake_fetch), \
+                patch.object(async_archiver, '_get_asset_pool') as get_pool, \
+                patch('requests.Session.get') as mock_get:
+            assert async_archiver.start_archive() is True
+            mock_get.assert_not_called()
+            # The loop fetched every resource: no thread pool prefetch
+            get_pool.assert_not_called()
+
+        assert sorted(fetched) == sorted(pages)
+        with open(os.path.join(async_archiver.output_dir, "index.html")) as f:
+            content = f.read()
+        assert 'data:image/jpeg;base64,' in content
+        assert '<style>' in content
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
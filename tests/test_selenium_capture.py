@@ -121,7 +121,7 @@ class TestDynamicContentCapture(unittest.TestCase):
         loading_element = self.driver.find_element(By.ID, "loading")
         self.assertEqual("Content Loaded!", loading_element.text)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     @patch('archiver.core.WebsiteArchiver.capture_ajax_content')
     def test_archiver_processes_dynamic_content(self, mock_capture_ajax, mock_get):
         """Test that the archiver processes dynamic content correctly"""
@@ -192,7 +192,7 @@ class TestDynamicContentCapture(unittest.TestCase):
         # Mock the Selenium driver to raise an exception
         with patch('selenium.webdriver.Chrome.get', side_effect=Exception("Selenium error")):
             # Setup a mock response for the requests fallback
-            with patch('requests.get', return_value=MockResponse(html_content)):
+            with patch('requests.Session.get', return_value=MockResponse(html_content)):
                 archiver = WebsiteArchiver("https://example.com", self.output_dir, wait_for_ajax=True)
                 
                 # This should not raise an exception despite Selenium failing